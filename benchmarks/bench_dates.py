@@ -0,0 +1,57 @@
+#!/usr/bin/python
+"""
+Micro-benchmark comparing parse_date with parse_api_date on the date fields of
+the appeals fixture scaled up.
+
+Usage:
+
+    python benchmarks/bench_dates.py [scale]
+
+"""
+
+import json
+import sys
+from os.path import dirname, join
+from timeit import default_timer
+
+from hdx.scraper.ifrc.dates import parse_api_date
+from hdx.utilities.dateparse import parse_date
+
+fields = ("start_date", "end_date", "real_data_update")
+
+
+def get_dates(scale):
+    path = join(dirname(__file__), "..", "tests", "fixtures", "input", "appeals_0.json")
+    with open(path, encoding="utf-8") as f:
+        results = json.load(f)["results"]
+    dates = [row[field] for row in results for field in fields]
+    return dates * scale
+
+
+def time_parser(parser, dates):
+    start = default_timer()
+    for date in dates:
+        parser(date)
+    return default_timer() - start
+
+
+def main(scale=100):
+    dates = get_dates(scale)
+    for date in set(dates):
+        assert parse_api_date(date) == parse_date(date), date
+    parse_api_date.cache_clear()
+    slow = time_parser(parse_date, dates)
+    fast = time_parser(parse_api_date, dates)
+    info = parse_api_date.cache_info()
+    print(f"{len(dates)} dates ({len(set(dates))} distinct)")
+    print(f"parse_date:     {slow:.3f}s")
+    print(f"parse_api_date: {fast:.3f}s (cache hits {info.hits}, misses {info.misses})")
+    print(f"Speed-up: {slow / fast:.0f}x")
+    parse_api_date.cache_clear()
+    fast = time_parser(parse_api_date.__wrapped__, dates)
+    print(f"parse_api_date without memoisation: {fast:.3f}s")
+    print(f"Speed-up: {slow / fast:.0f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+"""
+Benchmark of the full pipeline on synthetic GO API pages. Each stage is timed
+separately and, with --memory, run again under tracemalloc to get its peak
+memory. Results are written as JSON so that runs of different versions can be
+compared.
+
+With --latency (and optionally --bandwidth and --throttle-rate), the synthetic
+records are served over HTTP by the GO API stand-in server (benchmarks.goapi)
+rather than replayed from files, so that the fetch path is measured end to end.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.bench_pipeline --rows 10000 100000 --output results.json
+    python -m benchmarks.bench_pipeline --rows 10000 --latency 0.2 --bandwidth 1000000
+
+"""
+
+import argparse
+import json
+import platform
+import tracemalloc
+from datetime import datetime, timezone
+from os.path import join
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+
+from benchmarks.goapi import GOAPIServer
+from benchmarks.synthetic import generate, generate_records
+
+from hdx.api.configuration import Configuration
+from hdx.api.locations import Locations
+from hdx.data.resource import Resource
+from hdx.data.vocabulary import Vocabulary
+from hdx.location.country import Country
+from hdx.scraper.ifrc.pipeline import Pipeline, process_date
+from hdx.scraper.ifrc.writer import ResourceWriters
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.retriever import Retrieve
+from hdx.utilities.useragent import UserAgent
+
+try:
+    from hdx.scraper.ifrc._version import version
+except ImportError:
+    version = "unknown"
+
+dataset_types = ("appeals", "whowhatwhere")
+
+
+def setup_configuration():
+    """Set up a read only HDX configuration that needs no network access
+
+    Returns:
+        Configuration: HDX configuration
+    """
+    Configuration._create(
+        hdx_read_only=True,
+        user_agent="benchmark",
+        project_config_yaml=join(
+            "src", "hdx", "scraper", "ifrc", "config", "project_configuration.yaml"
+        ),
+    )
+    UserAgent.set_global("benchmark")
+    Country.countriesdata(use_live=False)
+    configuration = Configuration.read()
+    tags = []
+    for dataset_type in dataset_types:
+        tags.extend(configuration[dataset_type]["tags"])
+        configuration[dataset_type]["publish"] = True
+    Vocabulary._tags_dict = {tag: {"Action to Take": "ok"} for tag in tags}
+    Vocabulary._approved_vocabulary = {
+        "tags": [{"name": tag} for tag in tags],
+        "id": "b891512e-9516-4bf5-962a-7a289772a2a1",
+        "name": "approved",
+    }
+    Resource.set_formatsdict({"csv": "csv"})
+    return configuration
+
+
+class Stages:
+    """Time and optionally measure peak memory of stages"""
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.results = {}
+
+    def run(self, name, function, *args):
+        if self.memory:
+            tracemalloc.start()
+        start = default_timer()
+        result = function(*args)
+        seconds = default_timer() - start
+        stage = self.results.setdefault(name, {"seconds": 0.0})
+        stage["seconds"] += seconds
+        if self.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stage["peak_bytes"] = max(stage.get("peak_bytes", 0), peak)
+        return result
+
+
+def run_pipeline(configuration, input_folder, output_folder, stages):
+    with Download() as downloader:
+        retriever = Retrieve(
+            downloader,
+            output_folder,
+            input_folder or output_folder,
+            output_folder,
+            False,
+            input_folder is not None,
+        )
+        ifrc = Pipeline(
+            configuration,
+            retriever,
+            parse_date("2025-01-01"),
+            parse_date("2024-12-01"),
+        )
+        stages.run("countries", ifrc.get_countries)
+        no_rows = {}
+        writers = {}
+        for dataset_type in dataset_types:
+            filename = configuration[dataset_type]["filename"]
+            url_path = configuration[dataset_type]["url_path"]
+            url = f"{configuration['base_url']}{url_path}{configuration['get_params']}"
+            batches = stages.run(
+                "download_parse",
+                lambda: list(ifrc.iterate_batches(url, filename)),
+            )
+            ifrc.iterate_batches = lambda *args: iter(batches)
+            get_indicators = Pipeline.get_indicators
+
+            def timed_get_indicators(columns):
+                start = default_timer()
+                result = get_indicators(columns)
+                aggregation = stages.results.setdefault("aggregation", {"seconds": 0.0})
+                aggregation["seconds"] += default_timer() - start
+                return result
+
+            ifrc.get_indicators = timed_get_indicators
+            aggregation_before = stages.results.get("aggregation", {}).get(
+                "seconds", 0.0
+            )
+            rows = stages.run(
+                "transform", lambda: list(ifrc.get_rows(dataset_type, {}))
+            )
+            aggregation = (
+                stages.results.get("aggregation", {}).get("seconds", 0.0)
+                - aggregation_before
+            )
+            stages.results["transform"]["seconds"] -= aggregation
+            del ifrc.iterate_batches
+            del ifrc.get_indicators
+            no_rows[dataset_type] = len(rows)
+            heading = configuration[dataset_type]["heading"]
+
+            def write_csv():
+                with ResourceWriters(
+                    output_folder,
+                    lambda countryiso: ifrc.get_filename(heading, countryiso),
+                    process_date,
+                ) as resource_writers:
+                    for countryiso, row in rows:
+                        resource_writers.write(countryiso, row)
+                return resource_writers
+
+            writers[dataset_type] = stages.run("csv_generation", write_csv)
+        Locations.set_validlocations(
+            [{"name": x.lower(), "title": x.lower()} for x in ifrc.iso3_to_id if x]
+            + [{"name": "world", "title": "world"}]
+        )
+
+        def build_datasets():
+            no_datasets = 0
+            for dataset_type in dataset_types:
+                dataset_writers = writers[dataset_type]
+                global_dataset, _ = ifrc.generate_dataset_and_showcase(
+                    output_folder, dataset_writers, dataset_type
+                )
+                no_datasets += 1
+                for countryiso in dataset_writers.countries():
+                    dataset, _ = ifrc.generate_dataset_and_showcase(
+                        output_folder,
+                        dataset_writers,
+                        dataset_type,
+                        countryiso,
+                        global_dataset,
+                    )
+                    if dataset:
+                        no_datasets += 1
+            return no_datasets
+
+        no_datasets = stages.run("dataset_building", build_datasets)
+    return no_rows, no_datasets
+
+
+def serve(configuration, no_rows, page_size, server_options):
+    """Start GO API stand-in server for synthetic records and point the
+    configuration at it
+
+    Args:
+        configuration (Configuration): HDX configuration
+        no_rows (int): Number of appeals and projects
+        page_size (int): Number of records per page
+        server_options (dict): Arguments of GOAPIServer
+
+    Returns:
+        Tuple[GOAPIServer, Dict[str, int]]: Server and number of pages of each endpoint
+    """
+    records = generate_records(no_rows, no_rows)
+    endpoints = {}
+    pages = {}
+    for dataset_type, dataset_records in records.items():
+        endpoints[configuration[dataset_type]["url_path"]] = dataset_records
+        pages[dataset_type] = max(1, -(-len(dataset_records) // page_size))
+    server = GOAPIServer(endpoints, **server_options).start()
+    configuration["base_url"] = server.base_url
+    configuration["get_params"] = f"/?limit={page_size}&format=json"
+    return server, pages
+
+
+def benchmark(configuration, no_rows, page_size, memory, server_options=None):
+    with TemporaryDirectory() as input_folder:
+        with TemporaryDirectory() as output_folder:
+            server = None
+            if server_options is None:
+                pages = generate(
+                    input_folder, configuration, no_rows, no_rows, page_size
+                )
+            else:
+                server, pages = serve(configuration, no_rows, page_size, server_options)
+                input_folder = None
+            stages = Stages(False)
+            rows, no_datasets = run_pipeline(
+                configuration, input_folder, output_folder, stages
+            )
+            results = stages.results
+            if memory:
+                stages = Stages(True)
+                run_pipeline(configuration, input_folder, output_folder, stages)
+                for name, stage in stages.results.items():
+                    if "peak_bytes" in stage:
+                        results[name]["peak_bytes"] = stage["peak_bytes"]
+            if server is not None:
+                server.stop()
+    return {
+        "records": no_rows,
+        "pages": pages,
+        "rows": rows,
+        "datasets": no_datasets,
+        "stages": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000])
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--memory", action="store_true")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--latency", type=float)
+    parser.add_argument("--bandwidth", type=int)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    args = parser.parse_args()
+    configuration = setup_configuration()
+    server_options = None
+    if args.latency is not None:
+        server_options = {
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+            "throttle_rate": args.throttle_rate,
+        }
+        configuration["paging"]["backoff_seconds"] = 0.1
+    runs = []
+    for no_rows in args.rows:
+        run = benchmark(
+            configuration, no_rows, args.page_size, args.memory, server_options
+        )
+        runs.append(run)
+        print(json.dumps(run, indent=1))
+    output = {
+        "version": version,
+        "python": platform.python_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+"""
+GO API stand-in:
+---------------
+
+Local HTTP server standing in for the GO API so that paging, concurrency and
+retries of the fetch path can be tested and benchmarked without the network.
+It also answers POST requests so that it can stand in for the CKAN action API
+of HDX when publishing.
+
+"""
+
+import json
+import random
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import join
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+from hdx.utilities.loader import load_json
+
+
+def normalise_date(value):
+    """Normalise a GO API date or date filter for comparison as a string eg.
+    "2023-02-15 10:00:00+00:00" and "2023-02-15T10:00:00Z" both become
+    "2023-02-15T10:00:00"
+
+    Args:
+        value (str): Date
+
+    Returns:
+        str: Normalised date
+    """
+    return value.replace(" ", "T")[:19]
+
+
+def get_value(record, keys):
+    for key in keys:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+class GOAPIHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.goapi.track_active():
+            self.get()
+
+    def do_POST(self):
+        with self.server.goapi.track_active():
+            self.post()
+
+    def send_failure(self, status):
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+
+    def get(self):
+        goapi = self.server.goapi
+        parts = urlsplit(self.path)
+        endpoint = parts.path.strip("/").split("/")[-1]
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        status = goapi.get_failure(self.path)
+        if status is not None:
+            self.send_failure(status)
+            return
+        if goapi.etag and self.headers.get("If-None-Match") == goapi.etag:
+            goapi.add_request(self.path, None, None, 304)
+            self.send_response(304)
+            self.send_header("ETag", goapi.etag)
+            self.end_headers()
+            return
+        records = goapi.endpoints.get(endpoint)
+        if records is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        records = goapi.filter_records(endpoint, records, query)
+        limit = int(query.get("limit", goapi.default_limit))
+        offset = int(query.get("offset", 0))
+        end = offset + limit
+        url = f"{goapi.base_url}{endpoint}/?{parts.query}"
+        if "offset=" in url:
+            url = url[: url.index("&offset=")]
+        page = {
+            "count": len(records),
+            "next": f"{url}&offset={end}" if end < len(records) else None,
+            "previous": f"{url}&offset={max(offset - limit, 0)}" if offset else None,
+            "results": records[offset:end],
+        }
+        body = json.dumps(page).encode("utf-8")
+        goapi.add_request(self.path, limit, offset, 200)
+        if goapi.latency:
+            sleep(goapi.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if goapi.etag:
+            self.send_header("ETag", goapi.etag)
+        self.end_headers()
+        if goapi.get_truncation():
+            # cut the body off half way and drop the connection
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        if goapi.bandwidth:
+            chunk_size = max(1, goapi.bandwidth // 10)
+            for i in range(0, len(body), chunk_size):
+                self.wfile.write(body[i : i + chunk_size])
+                sleep(chunk_size / goapi.bandwidth)
+        else:
+            self.wfile.write(body)
+
+    def post(self):
+        goapi = self.server.goapi
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = json.loads(self.rfile.read(length) or "{}")
+        status = goapi.get_failure(self.path)
+        if status is not None:
+            self.send_failure(status)
+            return
+        if goapi.latency:
+            sleep(goapi.latency)
+        response = goapi.post_handler(self.path, request_body)
+        goapi.add_request(self.path, None, None, 200, request_body)
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GOAPIServer:
+    """Stand-in for the GO API serving records by endpoint (eg. appeal) with
+    count/next/previous pagination from the limit and offset query parameters
+    and filtering by query parameters ending in __gte on the dotted field path
+    they name (eg. appeal__real_data_update__gte filters on real_data_update).
+
+    Responses can be slowed by latency in seconds and a bandwidth cap in bytes
+    per second. Requests fail with 429 (throttled) at throttle_rate and with
+    503 at failure_rate, drawn from a random generator seeded with seed.
+    Status codes in failures are returned for the first requests before any
+    others. The bodies of the first truncations successful responses are cut
+    off half way. If etag is set, responses carry it and requests with a
+    matching If-None-Match header get 304 (not modified) with no body.
+
+    POST requests with a JSON body are answered with the JSON returned by
+    post_handler called with the path and body, by default a successful CKAN
+    action response. The largest number of requests handled at the same time
+    is kept in max_active.
+
+    Args:
+        endpoints (Dict[str, List[dict]]): Records by endpoint
+        latency (float): Seconds to wait before each response. Defaults to 0.
+        bandwidth (Optional[int]): Bytes per second of responses. Defaults to None.
+        throttle_rate (float): Fraction of requests throttled. Defaults to 0.
+        failure_rate (float): Fraction of requests that fail. Defaults to 0.
+        failures (Sequence[int]): Status codes of first requests. Defaults to ().
+        truncations (int): Number of first responses cut off. Defaults to 0.
+        seed (int): Random seed. Defaults to 0.
+        etag (Optional[str]): Entity tag of responses. Defaults to None.
+        post_handler (Optional[Callable[[str, dict], dict]]): Response to POST. Defaults to None.
+    """
+
+    default_limit = 50
+
+    def __init__(
+        self,
+        endpoints,
+        latency=0,
+        bandwidth=None,
+        throttle_rate=0,
+        failure_rate=0,
+        failures=(),
+        truncations=0,
+        seed=0,
+        etag=None,
+        post_handler=None,
+    ):
+        self.endpoints = endpoints
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.failures = list(failures)
+        self.truncations = truncations
+        self.random = random.Random(seed)
+        self.etag = etag
+        if post_handler is None:
+            post_handler = self.ckan_success
+        self.post_handler = post_handler
+        self.lock = Lock()
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.server = None
+        self.base_url = None
+
+    @classmethod
+    def from_fixtures(cls, input_folder, **kwargs):
+        """Create server for the records in the country and appeal fixtures
+
+        Args:
+            input_folder (str): Folder of fixtures
+            **kwargs: Arguments of GOAPIServer
+
+        Returns:
+            GOAPIServer: Server
+        """
+        countries = []
+        for i in range(2):
+            countries.extend(
+                load_json(join(input_folder, f"countries_{i}.json"))["results"]
+            )
+        appeals = load_json(join(input_folder, "appeals_0.json"))["results"]
+        endpoints = {"country": countries, "appeal": appeals, "project": []}
+        return cls(endpoints, **kwargs)
+
+    def get_failure(self, path):
+        """Get status code with which to fail a request if any
+
+        Args:
+            path (str): Path of request
+
+        Returns:
+            Optional[int]: Status code or None to respond normally
+        """
+        with self.lock:
+            if self.failures:
+                status = self.failures.pop(0)
+            elif self.random.random() < self.throttle_rate:
+                status = 429
+            elif self.random.random() < self.failure_rate:
+                status = 503
+            else:
+                return None
+        self.add_request(path, None, None, status)
+        return status
+
+    def get_truncation(self):
+        """Get whether to cut off the body of a successful response
+
+        Returns:
+            bool: True to cut off body
+        """
+        with self.lock:
+            if self.truncations:
+                self.truncations -= 1
+                return True
+            return False
+
+    @staticmethod
+    def ckan_success(path, body):
+        return {"success": True, "result": {}}
+
+    @contextmanager
+    def track_active(self):
+        """Count a request as being handled while in the context
+
+        Returns:
+            Generator[None, None, None]: Context of request
+        """
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def add_request(self, path, limit, offset, status, body=None):
+        with self.lock:
+            self.requests.append(
+                {
+                    "path": path,
+                    "limit": limit,
+                    "offset": offset,
+                    "status": status,
+                    "body": body,
+                }
+            )
+
+    @staticmethod
+    def filter_records(endpoint, records, query):
+        """Filter records by query parameters ending in __gte
+
+        Args:
+            endpoint (str): Endpoint
+            records (List[dict]): Records
+            query (Dict[str, str]): Query parameters
+
+        Returns:
+            List[dict]: Filtered records
+        """
+        for key, value in query.items():
+            if not key.endswith("__gte"):
+                continue
+            keys = key[: -len("__gte")].split("__")
+            if keys[0] == endpoint and len(keys) > 1:
+                keys = keys[1:]
+            value = normalise_date(value)
+            records = [
+                record
+                for record in records
+                if (field := get_value(record, keys)) is not None
+                and normalise_date(str(field)) >= value
+            ]
+        return records
+
+    def get_statuses(self):
+        with self.lock:
+            return [request["status"] for request in self.requests]
+
+    def start(self):
+        """Start server on a free local port in a background thread
+
+        Returns:
+            GOAPIServer: Server
+        """
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GOAPIHandler)
+        self.server.goapi = self
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/api/v2/"
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
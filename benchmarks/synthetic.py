@@ -0,0 +1,252 @@
+#!/usr/bin/python
+"""
+Synthetic GO API pages:
+----------------------
+
+Generates page files for the country, appeal and project endpoints in the same
+form as the GO API so that they can be replayed through Retrieve in use_saved
+mode at any scale.
+
+"""
+
+import json
+import random
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from os import makedirs
+from os.path import dirname, join
+
+fixtures_folder = join(dirname(__file__), "..", "tests", "fixtures", "input")
+
+sectors = ["Health", "WASH", "Shelter", "Livelihoods", "Protection", "Education"]
+programme_types = ["Bilateral", "Multilateral", "Domestic"]
+operation_types = ["Programme", "Emergency Operation"]
+statuses = ["Planned", "Ongoing", "Completed"]
+
+
+def load_fixture(filename):
+    with open(join(fixtures_folder, filename), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_countries():
+    """Get country records from the country fixtures
+
+    Returns:
+        List[dict]: Country records
+    """
+    countries = []
+    for i in range(2):
+        countries.extend(load_fixture(f"countries_{i}.json")["results"])
+    return countries
+
+
+def write_pages(folder, basename, url, records, page_size):
+    """Write records as pages of a GO API endpoint with count, next and previous
+
+    Args:
+        folder (str): Folder to write pages to
+        basename (str): Filename template with index placeholder
+        url (str): Url of endpoint used for next and previous
+        records (List[dict]): Records to write
+        page_size (int): Number of records per page
+
+    Returns:
+        int: Number of pages written
+    """
+    makedirs(folder, exist_ok=True)
+    count = len(records)
+    no_pages = max(1, -(-count // page_size))
+    for i in range(no_pages):
+        offset = i * page_size
+        if offset + page_size < count:
+            next_url = f"{url}&offset={offset + page_size}"
+        else:
+            next_url = None
+        if i == 0:
+            previous_url = None
+        else:
+            previous_url = f"{url}&offset={offset - page_size}"
+        page = {
+            "count": count,
+            "next": next_url,
+            "previous": previous_url,
+            "results": records[offset : offset + page_size],
+        }
+        with open(join(folder, basename.format(index=i)), "w", encoding="utf-8") as f:
+            json.dump(page, f)
+    return no_pages
+
+
+def format_date(date):
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_appeals(no_appeals, countries, rng):
+    """Generate appeal records based on the records in the appeals fixture,
+    ordered by start date descending like the GO API
+
+    Args:
+        no_appeals (int): Number of appeals
+        countries (List[dict]): Country records
+        rng (random.Random): Random number generator
+
+    Returns:
+        List[dict]: Appeal records
+    """
+    templates = load_fixture("appeals_0.json")["results"]
+    countries = [x for x in countries if x["iso3"] and x["record_type"] == 1]
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    appeals = []
+    for i in range(no_appeals):
+        appeal = deepcopy(templates[i % len(templates)])
+        country = rng.choice(countries)
+        appeal["aid"] = str(100000 + i)
+        appeal["id"] = str(200000 + i)
+        appeal["code"] = f"MDR{country['iso'] or 'XX'}{i:06d}"
+        appeal["status"] = rng.choices((0, 1, 3), (70, 20, 10))[0]
+        appeal["atype"] = rng.choice((0, 1))
+        appeal["num_beneficiaries"] = rng.randrange(100, 1000000)
+        appeal["amount_funded"] = f"{rng.randrange(1000, 10000000)}.00"
+        start_date = start + timedelta(days=rng.randrange(0, 1400))
+        end_date = start_date + timedelta(days=rng.randrange(30, 700))
+        appeal["start_date"] = format_date(start_date)
+        appeal["end_date"] = format_date(end_date)
+        updated = start_date + timedelta(days=rng.randrange(0, 30), seconds=i % 86400)
+        appeal["real_data_update"] = updated.strftime("%Y-%m-%d %H:%M:%S+00:00")
+        for key in ("iso", "iso3", "id", "society_name", "name", "fdrs"):
+            appeal["country"][key] = country[key]
+        appeals.append(appeal)
+    appeals.sort(key=lambda x: x["start_date"], reverse=True)
+    return appeals
+
+
+def generate_projects(no_projects, countries, rng):
+    """Generate project (3W) records with the fields read from the project
+    endpoint
+
+    Args:
+        no_projects (int): Number of projects
+        countries (List[dict]): Country records
+        rng (random.Random): Random number generator
+
+    Returns:
+        List[dict]: Project records
+    """
+    countries = [x for x in countries if x["iso3"] and x["record_type"] == 1]
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    projects = []
+    for i in range(no_projects):
+        country = rng.choice(countries)
+        reporting = rng.choice(countries)
+        start_date = start + timedelta(days=rng.randrange(0, 1400))
+        end_date = start_date + timedelta(days=rng.randrange(30, 1000))
+        targets = [rng.randrange(0, 5000) for _ in range(3)]
+        reached = [rng.randrange(0, x + 1) for x in targets]
+        projects.append(
+            {
+                "id": i,
+                "name": f"Project {i} in {country['name']}",
+                "project_country_detail": {
+                    "id": country["id"],
+                    "iso": country["iso"],
+                    "iso3": country["iso3"],
+                    "name": country["name"],
+                },
+                "project_districts_detail": [
+                    {"id": j, "name": f"District {j}"}
+                    for j in range(rng.randrange(0, 4))
+                ],
+                "reporting_ns_detail": {
+                    "id": reporting["id"],
+                    "society_name": reporting["society_name"],
+                },
+                "primary_sector_display": rng.choice(sectors),
+                "secondary_sectors_display": rng.sample(sectors, rng.randrange(0, 3)),
+                "programme_type_display": rng.choice(programme_types),
+                "operation_type_display": rng.choice(operation_types),
+                "status_display": rng.choice(statuses),
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+                "budget_amount": rng.randrange(0, 5000000),
+                "actual_expenditure": rng.randrange(0, 5000000),
+                "target_male": targets[0],
+                "target_female": targets[1],
+                "target_other": targets[2],
+                "target_total": sum(targets),
+                "reached_male": reached[0],
+                "reached_female": reached[1],
+                "reached_other": reached[2],
+                "reached_total": sum(reached),
+                "modified_at": format_date(start_date),
+            }
+        )
+    return projects
+
+
+def generate_records(no_appeals, no_projects, seed=0):
+    """Generate records for the country, appeal and project endpoints
+
+    Args:
+        no_appeals (int): Number of appeals
+        no_projects (int): Number of projects
+        seed (int): Random seed. Defaults to 0.
+
+    Returns:
+        Dict[str, List[dict]]: Records by dataset type (countries, appeals, whowhatwhere)
+    """
+    rng = random.Random(seed)
+    countries = get_countries()
+    return {
+        "countries": countries,
+        "appeals": generate_appeals(no_appeals, countries, rng),
+        "whowhatwhere": generate_projects(no_projects, countries, rng),
+    }
+
+
+def generate(folder, configuration, no_appeals, no_projects, page_size=200, seed=0):
+    """Generate page files for the country, appeal and project endpoints using
+    the filenames in the project configuration
+
+    Args:
+        folder (str): Folder to write pages to
+        configuration (dict): Project configuration
+        no_appeals (int): Number of appeals
+        no_projects (int): Number of projects
+        page_size (int): Number of records per page. Defaults to 200.
+        seed (int): Random seed. Defaults to 0.
+
+    Returns:
+        Dict[str, int]: Number of pages written for each endpoint
+    """
+    base_url = configuration["base_url"]
+    pages = {}
+    for endpoint, records in generate_records(no_appeals, no_projects, seed).items():
+        dataset_info = configuration[endpoint]
+        url = f"{base_url}{dataset_info['url_path']}/?limit={page_size}&format=json"
+        pages[endpoint] = write_pages(
+            folder, dataset_info["filename"], url, records, page_size
+        )
+    return pages
+
+
+if __name__ == "__main__":
+    import sys
+
+    from hdx.utilities.loader import load_yaml
+
+    config = load_yaml(
+        join(
+            dirname(__file__),
+            "..",
+            "src",
+            "hdx",
+            "scraper",
+            "ifrc",
+            "config",
+            "project_configuration.yaml",
+        )
+    )
+    output_folder = sys.argv[1]
+    no_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    print(generate(output_folder, config, no_rows, no_rows))
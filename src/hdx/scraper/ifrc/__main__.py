@@ -6,17 +6,21 @@ Top level script. Calls other functions that generate datasets that this script
 
 import logging
 from os.path import expanduser, join
+from time import perf_counter
 
 from hdx.api.configuration import Configuration
 from hdx.api.utilities.hdx_state import HDXState
 from hdx.data.user import User
 from hdx.facades.infer_arguments import facade
 from hdx.scraper.ifrc._version import __version__
+from hdx.scraper.ifrc.fingerprints import FingerprintIndex, get_fingerprint
+from hdx.scraper.ifrc.instrumentation import RunMetrics
+from hdx.scraper.ifrc.pagearchive import PageArchive
 from hdx.scraper.ifrc.pipeline import Pipeline
+from hdx.scraper.ifrc.publisher import Publisher
 from hdx.utilities.dateparse import iso_string_from_datetime, now_utc, parse_date
 from hdx.utilities.downloader import Download
 from hdx.utilities.path import (
-    progress_storing_folder,
     script_dir_plus_file,
     wheretostart_tempdir_batch,
 )
@@ -44,6 +48,8 @@ def main(save: bool = False, use_saved: bool = False) -> None:
     User.check_current_user_write_access(
         "3ada79f1-a239-4e09-bb2e-55743b7e6b69", configuration=configuration
     )
+    run_report = configuration["run_report"]
+    metrics = RunMetrics(run_report["profile"])
     with wheretostart_tempdir_batch(lookup) as info:
         folder = info["folder"]
         with HDXState(
@@ -54,25 +60,45 @@ def main(save: bool = False, use_saved: bool = False) -> None:
             configuration,
         ) as state:
             with Download() as downloader:
+                page_archive = None
+                archive_filename = configuration["page_archive"]
+                if archive_filename and (save or use_saved):
+                    page_archive = PageArchive(
+                        join("saved_data", archive_filename), "r" if use_saved else "w"
+                    )
                 retriever = Retrieve(
-                    downloader, folder, "saved_data", folder, save, use_saved
+                    downloader,
+                    folder,
+                    "saved_data",
+                    folder,
+                    save and page_archive is None,
+                    use_saved and page_archive is None,
                 )
                 now = now_utc()
-                ifrc = Pipeline(configuration, retriever, now, state.get())
-                ifrc.get_countries()
-                (
-                    appeal_rows,
-                    appeal_country_rows,
-                    appeal_countries_to_update,
-                ) = ifrc.get_appealdata()
+                # replayed data must not change the state of live runs
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    now,
+                    state.get(),
+                    None if use_saved else configuration["state_folder"],
+                    metrics,
+                    join(folder, "checkpoints"),
+                    page_archive,
+                )
+                try:
+                    results = ifrc.fetch_all(folder)
+                finally:
+                    if page_archive is not None:
+                        page_archive.close()
                 countries_list = []
+                appeal_writers, appeal_countries_to_update = results["appeals"]
                 if appeal_countries_to_update:
                     countries_list.append(set(appeal_countries_to_update))
                 (
-                    whowhatwhere_rows,
-                    whowhatwhere_country_rows,
+                    whowhatwhere_writers,
                     whowhatwhere_countries_to_update,
-                ) = ifrc.get_whowhatwheredata()
+                ) = results["whowhatwhere"]
                 if whowhatwhere_countries_to_update:
                     countries_list.append(set(whowhatwhere_countries_to_update))
 
@@ -80,19 +106,33 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                 countries = [{"iso3": x} for x in sorted(countries)]
                 logger.info(f"Number of countries: {len(countries)}")
 
+                fingerprints = FingerprintIndex(
+                    join(
+                        configuration["state_folder"],
+                        configuration["fingerprints_filename"],
+                    )
+                )
+
                 def create_dataset(
                     dataset,
                     showcase,
                     dataset_path,
+                    countryiso=None,
                 ):
                     if not dataset:
                         return
                     notes = f"\n\n{dataset['notes']}"
-                    dataset.update_from_yaml(dataset_path)
+                    ifrc.caches.update_from_yaml(dataset, dataset_path)
                     notes = f"{dataset['notes']}{notes}"
                     # ensure markdown has line breaks
                     dataset["notes"] = notes.replace("\n", "  \n")
 
+                    name = dataset["name"]
+                    fingerprint = get_fingerprint(dataset, showcase)
+                    if not fingerprints.check(name, fingerprint):
+                        logger.info(f"Dataset {name} unchanged. Skipping upload.")
+                        return
+                    start = perf_counter()
                     dataset.create_in_hdx(
                         remove_additional_resources=True,
                         updated_by_script=updated_by_script,
@@ -102,14 +142,20 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                     if showcase:
                         showcase.create_in_hdx()
                         showcase.add_dataset(dataset)
+                    seconds = perf_counter() - start
+                    metrics.add("hdx_upload", seconds, countryiso, datasets=1)
+                    metrics.add_latency("hdx_upload", seconds, countryiso)
+                    fingerprints.set(name, fingerprint)
 
                 if countries:
                     (
                         appeals_dataset,
                         showcase,
                     ) = ifrc.generate_dataset_and_showcase(
-                        folder, appeal_rows, "appeals"
+                        folder, appeal_writers, "appeals"
                     )
+                    if configuration["appeals"]["indicators_resource"]:
+                        ifrc.add_indicators_resource(folder, appeals_dataset)
                     create_dataset(
                         appeals_dataset,
                         showcase,
@@ -122,7 +168,7 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                         showcase,
                     ) = ifrc.generate_dataset_and_showcase(
                         folder,
-                        whowhatwhere_rows,
+                        whowhatwhere_writers,
                         "whowhatwhere",
                     )
                     create_dataset(
@@ -132,17 +178,19 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                             join("config", "hdx_whowhatwhere_dataset.yaml"), main
                         ),
                     )
-                for _, country in progress_storing_folder(info, countries, "iso3"):
+
+                def generate_country_dataset(
+                    rows, dataset_type, countryiso, global_dataset
+                ):
+                    with metrics.time(f"{dataset_type}.dataset", countryiso):
+                        return ifrc.generate_dataset_and_showcase(
+                            folder, rows, dataset_type, countryiso, global_dataset
+                        )
+
+                def publish_country(country):
                     countryiso = country["iso3"]
-                    (
-                        dataset,
-                        showcase,
-                    ) = ifrc.generate_dataset_and_showcase(
-                        folder,
-                        appeal_country_rows,
-                        "appeals",
-                        countryiso,
-                        appeals_dataset,
+                    dataset, showcase = generate_country_dataset(
+                        appeal_writers, "appeals", countryiso, appeals_dataset
                     )
                     create_dataset(
                         dataset,
@@ -150,10 +198,10 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                         script_dir_plus_file(
                             join("config", "hdx_appeals_dataset.yaml"), main
                         ),
+                        countryiso,
                     )
-                    dataset, showcase = ifrc.generate_dataset_and_showcase(
-                        folder,
-                        whowhatwhere_country_rows,
+                    dataset, showcase = generate_country_dataset(
+                        whowhatwhere_writers,
                         "whowhatwhere",
                         countryiso,
                         whowhatwhere_dataset,
@@ -164,11 +212,34 @@ def main(save: bool = False, use_saved: bool = False) -> None:
                         script_dir_plus_file(
                             join("config", "hdx_whowhatwhere_dataset.yaml"), main
                         ),
+                        countryiso,
+                    )
+
+                publisher = Publisher(
+                    info,
+                    "iso3",
+                    configuration["publish_workers"],
+                    configuration.get("publish_rate_limit"),
+                )
+                try:
+                    with metrics.time("publish", countries=len(countries)):
+                        if not publisher.run(countries, publish_country):
+                            logger.info("Nothing to update!")
+                finally:
+                    fingerprints.write()
+                    logger.info(fingerprints.get_summary())
+                    logger.info(f"Caches: {ifrc.caches.get_summary()}")
+                    ifrc.caches.add_to_metrics(metrics)
+                    metrics.log_summary()
+                    metrics.write(
+                        run_report["folder"] or configuration["state_folder"],
+                        version=__version__,
+                        batch=info["batch"],
                     )
-                else:
-                    logger.info("Nothing to update!")
+                ifrc.save_deltas()
 
-        state.set(now_utc())
+            # only advance once all feeds are downloaded and datasets published
+            state.set(now)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+"""
+Caches:
+------
+
+Run scoped memoisation of pure lookups on hot paths (country names, slugs and
+dataset metadata) with hit and miss counters.
+
+"""
+
+import logging
+from copy import deepcopy
+from functools import lru_cache
+from threading import Lock
+
+from slugify import slugify
+
+from hdx.location.country import Country
+from hdx.utilities.dictandlist import merge_two_dictionaries
+from hdx.utilities.loader import load_yaml
+
+logger = logging.getLogger(__name__)
+
+
+def get_slug(name):
+    return slugify(name).lower()
+
+
+class RunCaches:
+    """Bounded LRU caches for the lifetime of a run of country names by iso3,
+    slugs of dataset names and the static dataset metadata read from YAML
+    files, along with templates of dataset metadata built once per dataset
+    type. Each cache counts its hits and misses. It is safe to use from
+    multiple threads.
+
+    Args:
+        maxsize (int): Maximum number of entries of each lookup cache. Defaults to 1024.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.country_name = lru_cache(maxsize=maxsize)(
+            Country.get_country_name_from_iso3
+        )
+        self.slugify = lru_cache(maxsize=maxsize)(get_slug)
+        self.load_yaml = lru_cache(maxsize=16)(load_yaml)
+        self.templates = {}
+        self.template_hits = 0
+        self.template_misses = 0
+        self.lock = Lock()
+
+    def get_template(self, key, build):
+        """Get template building it the first time it is requested. The
+        template is shared so it must be copied before it is changed.
+
+        Args:
+            key (Hashable): Key of template
+            build (Callable[[], Any]): Function that builds template
+
+        Returns:
+            Any: Template
+        """
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                self.template_hits += 1
+                return template
+            self.template_misses += 1
+        template = build()
+        with self.lock:
+            return self.templates.setdefault(key, template)
+
+    def update_from_yaml(self, dataset, path):
+        """Update dataset with static metadata from YAML file like
+        Dataset.update_from_yaml, reading and parsing the file only once
+
+        Args:
+            dataset (Dataset): Dataset to update
+            path (str): Path to YAML dataset metadata
+
+        Returns:
+            None
+        """
+        merge_two_dictionaries(dataset.data, deepcopy(self.load_yaml(path)))
+        dataset.separate_resources()
+
+    def get_stats(self):
+        """Get hits, misses and size of each cache
+
+        Returns:
+            Dict[str, Dict[str, int]]: Statistics by cache
+        """
+        stats = {}
+        for name in ("country_name", "slugify", "load_yaml"):
+            info = getattr(self, name).cache_info()
+            stats[name] = {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+            }
+        with self.lock:
+            stats["templates"] = {
+                "hits": self.template_hits,
+                "misses": self.template_misses,
+                "size": len(self.templates),
+            }
+        return stats
+
+    def add_to_metrics(self, metrics):
+        """Add hits and misses of each cache to run metrics as cache.<name>
+        stages
+
+        Args:
+            metrics (RunMetrics): Run metrics
+
+        Returns:
+            None
+        """
+        for name, stats in self.get_stats().items():
+            metrics.add(f"cache.{name}", hits=stats["hits"], misses=stats["misses"])
+
+    def get_summary(self):
+        return ", ".join(
+            f"{name} {stats['hits']} hits/{stats['misses']} misses"
+            for name, stats in self.get_stats().items()
+        )
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""
+Checkpoints:
+-----------
+
+Page level checkpoints of paginated GO API downloads so that a restarted run
+replays the pages it already has and carries on from the first missing one.
+
+"""
+
+import json
+import logging
+from os import makedirs, replace
+from os.path import exists, join
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def save_json_atomic(data, path):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    replace(temp_path, path)
+
+
+class PageCheckpoint:
+    """Checkpoint of the pages of one feed. Each page received is saved to the
+    checkpoint folder and recorded in a manifest with its next url. Once all
+    pages are received, the manifest is marked complete. The manifest also
+    stores the url of the first page and a checkpoint for a different url (eg.
+    with a different date filter) is ignored.
+
+    Args:
+        folder (str): Folder in which to store pages and manifest
+        basename (str): Filename template for pages with {index}
+        url (str): Url of first page
+    """
+
+    def __init__(self, folder, basename, url):
+        self.folder = folder
+        self.basename = basename
+        self.url = url
+        self.path = join(folder, basename.format(index="checkpoint"))
+        self.pages = {}
+        self.complete = False
+        self.lock = Lock()
+        if exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["url"] == url:
+                self.pages = manifest["pages"]
+                self.complete = manifest["complete"]
+                logger.info(
+                    f"Resuming from checkpoint with {len(self.pages)} pages in {self.path}"
+                )
+            else:
+                logger.info(f"Ignoring checkpoint for different url in {self.path}")
+
+    def get_page_path(self, index):
+        return join(self.folder, self.basename.format(index=index))
+
+    def has_page(self, index):
+        return str(index) in self.pages
+
+    def load_page(self, index):
+        """Load page from checkpoint
+
+        Args:
+            index (int): Page index
+
+        Returns:
+            dict: JSON of page
+        """
+        with open(self.get_page_path(index), encoding="utf-8") as f:
+            return json.load(f)
+
+    def write(self):
+        makedirs(self.folder, exist_ok=True)
+        save_json_atomic(
+            {"url": self.url, "pages": self.pages, "complete": self.complete},
+            self.path,
+        )
+
+    def add_page(self, index, page):
+        """Save page and record it with its next url in the manifest
+
+        Args:
+            index (int): Page index
+            page (dict): JSON of page
+
+        Returns:
+            None
+        """
+        makedirs(self.folder, exist_ok=True)
+        save_json_atomic(page, self.get_page_path(index))
+        with self.lock:
+            self.pages[str(index)] = page["next"]
+            self.write()
+
+    def add_streamed_page(self, index, next_url):
+        """Record a page that has been written to its page path as it was
+        received (eg. when streamed) with its next url in the manifest
+
+        Args:
+            index (int): Page index
+            next_url (Optional[str]): Url of next page
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.pages[str(index)] = next_url
+            self.write()
+
+    def set_complete(self):
+        """Mark all pages as received
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.complete = True
+            self.write()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+"""
+Deltas:
+------
+
+Persistent index of a fingerprint of each record's exported fields so that the
+records added, changed and removed since the last run, and the countries they
+affect, can be worked out exactly.
+
+"""
+
+import hashlib
+import json
+import logging
+from os import makedirs, replace
+from os.path import dirname, exists
+
+logger = logging.getLogger(__name__)
+
+
+def get_row_hash(row):
+    """Get hash of the fields of a row. Every exported field counts, including
+    timestamps, as a change to any of them changes the published resources.
+
+    Args:
+        row (dict): Row
+
+    Returns:
+        str: Hex digest of hash
+    """
+    data = json.dumps(list(row.items()), separators=(",", ":"), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DeltaIndex:
+    """Index of record key to country iso3 and hash of exported fields as of
+    the last run, stored as JSON. Records of this run are added one at a time
+    and compared with the index to count those added and changed and collect
+    the countries they affect (both the old and new country of a record that
+    moved). If the records of a run are complete (eg. all appeals rather than
+    only those modified since the last run), records in the index that were not
+    seen are counted as removed. Otherwise, the index is only updated with the
+    records seen.
+
+    If there is no index file yet (eg. the first run with a state folder), the
+    index is seeded: records are stored without being counted as added or
+    their countries collected, as there is nothing to compare them with, and
+    seeding is True so that the countries to update can be worked out some
+    other way for that run.
+
+    The index is only written by save so that a run that fails before
+    publishing finds the same changes next time.
+
+    Args:
+        path (str): Path of index file
+        complete (bool): Whether each run sees all records
+    """
+
+    def __init__(self, path, complete):
+        self.path = path
+        self.complete = complete
+        self.previous = {}
+        self.seeding = not exists(path)
+        if not self.seeding:
+            with open(path, encoding="utf-8") as f:
+                self.previous = json.load(f)
+        self.current = {}
+        self.countries = set()
+        self.seeded = 0
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+
+    def add(self, key, countryiso, row):
+        """Add record of this run and compare it with the index
+
+        Args:
+            key (Any): Record key (eg. aid)
+            countryiso (str): Country iso3
+            row (dict): Exported row of record
+
+        Returns:
+            bool: True if record added or changed, False if unchanged or seeding
+        """
+        key = str(key)
+        entry = [countryiso, get_row_hash(row)]
+        self.current[key] = entry
+        if self.seeding:
+            self.seeded += 1
+            return False
+        previous = self.previous.get(key)
+        if previous == entry:
+            return False
+        if previous is None:
+            self.added += 1
+        else:
+            self.changed += 1
+            self.countries.add(previous[0])
+        self.countries.add(countryiso)
+        return True
+
+    def finish(self):
+        """Find removed records once all records of the run have been added
+
+        Returns:
+            Set[str]: Countries affected by records added, changed or removed
+        """
+        if self.complete:
+            for key, (countryiso, _) in self.previous.items():
+                if key not in self.current:
+                    self.removed += 1
+                    self.countries.add(countryiso)
+        self.countries.discard(None)
+        return self.countries
+
+    def save(self):
+        """Write index of records as of this run to file
+
+        Returns:
+            None
+        """
+        if self.complete:
+            index = self.current
+        else:
+            index = {**self.previous, **self.current}
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, separators=(",", ":"), sort_keys=True)
+        replace(temp_path, self.path)
+
+    def get_summary(self):
+        if self.seeding:
+            return f"index seeded with {self.seeded} records"
+        return (
+            f"{self.added} added, {self.changed} changed, {self.removed} removed "
+            f"records in {len(self.countries)} countries"
+        )
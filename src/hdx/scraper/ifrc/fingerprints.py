@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Fingerprints:
+------------
+
+Content hashes of generated datasets so that unchanged datasets are not
+uploaded to HDX again.
+
+"""
+
+import hashlib
+import json
+import logging
+from os import makedirs, replace
+from os.path import dirname, exists
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, hasher):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            hasher.update(chunk)
+
+
+def get_fingerprint(dataset, showcase=None):
+    """Get content hash of dataset metadata, the metadata and file of each of
+    its resources and the metadata of its showcase if there is one
+
+    Args:
+        dataset (Dataset): Dataset
+        showcase (Optional[Showcase]): Showcase. Defaults to None.
+
+    Returns:
+        str: Hex digest of fingerprint
+    """
+    hasher = hashlib.sha256()
+    metadata = {"dataset": dataset.data}
+    if showcase:
+        metadata["showcase"] = showcase.data
+    metadata["resources"] = [resource.data for resource in dataset.get_resources()]
+    hasher.update(json.dumps(metadata, sort_keys=True, default=str).encode("utf-8"))
+    for resource in dataset.get_resources():
+        path = resource.get_file_to_upload()
+        if path:
+            hash_file(path, hasher)
+    return hasher.hexdigest()
+
+
+class FingerprintIndex:
+    """Index of dataset name to fingerprint of the dataset as last uploaded,
+    stored as JSON. It is safe to use from multiple publishing threads.
+
+    Args:
+        path (str): Path of index file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        self.unchanged = 0
+        self.changed = 0
+        self.lock = Lock()
+        if exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.fingerprints = json.load(f)
+
+    def check(self, name, fingerprint):
+        """Check if dataset has changed since last uploaded, counting the
+        result
+
+        Args:
+            name (str): Dataset name
+            fingerprint (str): Fingerprint of dataset
+
+        Returns:
+            bool: True if changed, False if not
+        """
+        with self.lock:
+            if self.fingerprints.get(name) == fingerprint:
+                self.unchanged += 1
+                return False
+            self.changed += 1
+            return True
+
+    def set(self, name, fingerprint):
+        """Record fingerprint of uploaded dataset
+
+        Args:
+            name (str): Dataset name
+            fingerprint (str): Fingerprint of dataset
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.fingerprints[name] = fingerprint
+
+    def write(self):
+        """Write index to file
+
+        Returns:
+            None
+        """
+        with self.lock:
+            folder = dirname(self.path)
+            if folder:
+                makedirs(folder, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.fingerprints, f, indent=1, sort_keys=True)
+            replace(temp_path, self.path)
+
+    def get_summary(self):
+        return f"{self.changed} datasets uploaded, {self.unchanged} unchanged uploads avoided"
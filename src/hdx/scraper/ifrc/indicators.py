@@ -0,0 +1,145 @@
+#!/usr/bin/python
+"""
+Indicators:
+----------
+
+Array backed aggregation of appeal indicators over month, country and appeal
+type.
+
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def get_quarter(year_month):
+    return f"{year_month[:4]}-Q{(int(year_month[5:7]) - 1) // 3 + 1}"
+
+
+class IndicatorCube:
+    """Cube of measures (a count of rows plus summed measures) over dimensions.
+    Each dimension has a sorted array of labels and each measure is a NumPy
+    array with one axis per dimension.
+
+    Args:
+        dimensions (Sequence[str]): Names of dimensions
+        labels (Sequence[np.ndarray]): Labels of each dimension
+        values (Dict[str, np.ndarray]): Array of each measure
+    """
+
+    def __init__(self, dimensions, labels, values):
+        self.dimensions = tuple(dimensions)
+        self.labels = list(labels)
+        self.values = values
+
+    @classmethod
+    def from_columns(cls, columns, dimensions, measures):
+        """Aggregate columns in one batch. Rows are counted in the measure number
+        and the given measures are summed.
+
+        Args:
+            columns (Dict[str, Sequence]): Column values by column name
+            dimensions (Sequence[str]): Columns to use as dimensions
+            measures (Sequence[str]): Columns to sum
+
+        Returns:
+            IndicatorCube: Aggregated cube
+        """
+        labels = []
+        codes = []
+        for dimension in dimensions:
+            dimension_labels, dimension_codes = np.unique(
+                np.asarray(columns[dimension], dtype=str), return_inverse=True
+            )
+            labels.append(dimension_labels)
+            codes.append(dimension_codes)
+        shape = tuple(len(x) for x in labels)
+        size = int(np.prod(shape))
+        if size:
+            index = np.ravel_multi_index(codes, shape)
+        else:
+            index = np.zeros(0, dtype=np.intp)
+        values = {"number": np.bincount(index, minlength=size).reshape(shape)}
+        for measure in measures:
+            weights = np.asarray(columns[measure], dtype=float)
+            values[measure] = np.bincount(
+                index, weights=weights, minlength=size
+            ).reshape(shape)
+        return cls(dimensions, labels, values)
+
+    def group_by(self, dimension, mapping):
+        """Roll up a dimension by mapping its labels to new labels, for example
+        months to quarters or countries to regions. Labels mapped to the same
+        new label are summed.
+
+        Args:
+            dimension (str): Dimension to roll up
+            mapping (Callable[[str], str]): Function mapping old to new label
+
+        Returns:
+            IndicatorCube: Rolled up cube
+        """
+        axis = self.dimensions.index(dimension)
+        new_labels, codes = np.unique(
+            np.asarray([mapping(x) for x in self.labels[axis]], dtype=str),
+            return_inverse=True,
+        )
+        values = {}
+        for measure, array in self.values.items():
+            array = np.moveaxis(array, axis, 0)
+            new_array = np.zeros((len(new_labels),) + array.shape[1:], array.dtype)
+            np.add.at(new_array, codes, array)
+            values[measure] = np.moveaxis(new_array, 0, axis)
+        labels = list(self.labels)
+        labels[axis] = new_labels
+        return IndicatorCube(self.dimensions, labels, values)
+
+    def quarterly(self):
+        """Roll up months (YYYY-MM) into quarters (YYYY-Qn)
+
+        Returns:
+            IndicatorCube: Quarterly cube
+        """
+        return self.group_by("month", get_quarter)
+
+    def get(self, *labels):
+        """Get measures for a cell given a label for each dimension
+
+        Args:
+            *labels (str): Label of each dimension
+
+        Returns:
+            Dict[str, float]: Measures for the cell (zero if not present)
+        """
+        index = []
+        for dimension_labels, label in zip(self.labels, labels):
+            position = np.searchsorted(dimension_labels, label)
+            if position == len(dimension_labels) or dimension_labels[position] != label:
+                return {measure: 0 for measure in self.values}
+            index.append(position)
+        index = tuple(index)
+        return {measure: array[index].item() for measure, array in self.values.items()}
+
+    def to_rows(self):
+        """Get tidy rows with one row per non empty cell
+
+        Returns:
+            List[dict]: Rows with a column per dimension and measure
+        """
+        number = self.values["number"]
+        rows = []
+        for index in zip(*np.nonzero(number)):
+            row = {
+                dimension: self.labels[i][position].item()
+                for i, (dimension, position) in enumerate(zip(self.dimensions, index))
+            }
+            for measure, array in self.values.items():
+                value = array[index].item()
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                row[measure] = value
+            rows.append(row)
+        return rows
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+"""
+Instrumentation:
+---------------
+
+Per stage and per country timings, counts, memory and HTTP latencies of a run
+written out as a JSON run report.
+
+"""
+
+import logging
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from cProfile import Profile
+from os import makedirs
+from os.path import join
+from pstats import Stats
+from threading import Lock, local
+from time import perf_counter
+
+from hdx.utilities.saver import save_json
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of HTTP latency histogram buckets
+latency_buckets = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def get_peak_rss():
+    """Get peak resident set size of the process so far
+
+    Returns:
+        Optional[int]: Peak RSS in bytes or None if not available
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class RunMetrics:
+    """Collects wall time, counts (eg. pages, bytes, rows), increases in peak
+    RSS and HTTP latency histograms for each stage of a run and for each
+    country. The peak RSS of the whole run is in the report. It is safe to use
+    from multiple threads. If profile is True, sections run under
+    profile() are profiled with cProfile, one profiler per thread, and the
+    profiles of all threads are merged when written.
+
+    Args:
+        profile (bool): Whether to profile hot sections. Defaults to False.
+    """
+
+    def __init__(self, profile=False):
+        self.stages = {}
+        self.countries = {}
+        self.lock = Lock()
+        self.start = perf_counter()
+        self.profile_enabled = profile
+        self.profilers = []
+        self.thread_state = local()
+
+    def get_stage(self, name, countryiso=None):
+        if countryiso is None:
+            stages = self.stages
+        else:
+            stages = self.countries.setdefault(countryiso, {})
+        stage = stages.get(name)
+        if stage is None:
+            stage = stages[name] = {"seconds": 0.0, "calls": 0}
+        return stage
+
+    def add(self, name, seconds=0.0, countryiso=None, **counts):
+        """Add time and counts to a stage. If a country is given, they are also
+        added to the stage for that country.
+
+        Args:
+            name (str): Stage name
+            seconds (float): Wall time in seconds. Defaults to 0.0.
+            countryiso (Optional[str]): Country iso3. Defaults to None.
+            **counts (int): Counts to add eg. rows=10
+
+        Returns:
+            None
+        """
+        with self.lock:
+            stages = [self.get_stage(name)]
+            if countryiso is not None:
+                stages.append(self.get_stage(name, countryiso))
+            for stage in stages:
+                stage["seconds"] += seconds
+                stage["calls"] += 1
+                for key, value in counts.items():
+                    stage[key] = stage.get(key, 0) + value
+
+    @contextmanager
+    def time(self, name, countryiso=None, **counts):
+        """Time a block of code as a stage, optionally for a country. How much
+        the block raised the peak RSS of the process is added to the stage as
+        peak_rss_increase_bytes.
+
+        Args:
+            name (str): Stage name
+            countryiso (Optional[str]): Country iso3. Defaults to None.
+            **counts (int): Counts to add eg. rows=10
+
+        Returns:
+            None
+        """
+        peak_rss = get_peak_rss()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            if peak_rss is not None:
+                counts["peak_rss_increase_bytes"] = get_peak_rss() - peak_rss
+            self.add(name, seconds, countryiso, **counts)
+
+    def add_latency(self, name, seconds, countryiso=None):
+        """Add an HTTP latency to the latency histogram of a stage. If a
+        country is given, it is also added to the histogram of the stage for
+        that country.
+
+        Args:
+            name (str): Stage name
+            seconds (float): Latency in seconds
+            countryiso (Optional[str]): Country iso3. Defaults to None.
+
+        Returns:
+            None
+        """
+        bucket = bisect_left(latency_buckets, seconds)
+        if bucket == len(latency_buckets):
+            bucket = "inf"
+        else:
+            bucket = str(latency_buckets[bucket])
+        with self.lock:
+            stages = [self.get_stage(name)]
+            if countryiso is not None:
+                stages.append(self.get_stage(name, countryiso))
+            for stage in stages:
+                histogram = stage.setdefault("latency_histogram", {})
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def add_request(self, name, seconds, no_bytes, countryiso=None):
+        """Add an HTTP request (or read of a saved page) to a stage, optionally
+        for a country
+
+        Args:
+            name (str): Stage name
+            seconds (float): Latency in seconds
+            no_bytes (int): Size of response in bytes
+            countryiso (Optional[str]): Country iso3. Defaults to None.
+
+        Returns:
+            None
+        """
+        self.add(name, seconds, countryiso, pages=1, bytes=no_bytes)
+        self.add_latency(name, seconds, countryiso)
+
+    @contextmanager
+    def profile(self):
+        """Profile a block of code with cProfile if profiling is enabled. Each
+        thread gets its own profiler. Blocks nested in another profiled block
+        on the same thread are not profiled separately. From Python 3.12, only
+        one profiler can be active at a time so a block started while another
+        thread is being profiled is not profiled.
+
+        Returns:
+            None
+        """
+        thread_state = self.thread_state
+        if not self.profile_enabled or getattr(thread_state, "profiling", False):
+            yield
+            return
+        profiler = getattr(thread_state, "profiler", None)
+        if profiler is None:
+            profiler = thread_state.profiler = Profile()
+            with self.lock:
+                self.profilers.append(profiler)
+        try:
+            profiler.enable()
+        except ValueError as ex:  # Another profiler is active (Python 3.12+)
+            logger.warning(f"Not profiling as another profiler is active: {ex}")
+            yield
+            return
+        thread_state.profiling = True
+        try:
+            yield
+        finally:
+            profiler.disable()
+            thread_state.profiling = False
+
+    def get_report(self):
+        """Get run report
+
+        Returns:
+            dict: Run report
+        """
+        with self.lock:
+            return {
+                "seconds": perf_counter() - self.start,
+                "peak_rss_bytes": get_peak_rss(),
+                "stages": self.stages,
+                "countries": self.countries,
+            }
+
+    def log_summary(self):
+        for name, stage in self.stages.items():
+            logger.info(f"Stage {name}: {stage['seconds']:.2f}s")
+
+    def write(self, folder, filename="run_report.json", **metadata):
+        """Write run report as JSON and, if profiling, cProfile statistics to
+        folder
+
+        Args:
+            folder (str): Folder to write to
+            filename (str): Filename of run report. Defaults to "run_report.json".
+            **metadata (Any): Additional fields to add to run report
+
+        Returns:
+            str: Path of run report
+        """
+        report = metadata
+        report.update(self.get_report())
+        makedirs(folder, exist_ok=True)
+        path = join(folder, filename)
+        save_json(report, path, pretty=True)
+        logger.info(f"Run report written to {path}")
+        if self.profile_enabled:
+            profilers = [profiler for profiler in self.profilers if profiler.getstats()]
+            if profilers:
+                profile_path = join(folder, "run_profile.prof")
+                Stats(*profilers).dump_stats(profile_path)
+                logger.info(f"Profile written to {profile_path}")
+            else:
+                logger.warning("Nothing was profiled!")
+        return path
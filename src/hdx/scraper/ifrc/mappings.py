@@ -0,0 +1,224 @@
+#!/usr/bin/python
+"""
+Mappings:
+--------
+
+Compiles field mappings of endpoints declared in the project configuration into
+extractor functions that turn GO API records into rows.
+
+"""
+
+import logging
+from operator import itemgetter, methodcaller
+
+logger = logging.getLogger(__name__)
+
+
+def flatten(data):
+    new_data = {}
+    for key, value in data.items():
+        if not isinstance(value, dict):
+            new_data[key] = value
+        else:
+            for k, v in value.items():
+                new_data[f"{key}.{k}"] = v
+    return new_data
+
+
+def compile_path(path):
+    """Compile a dotted path (eg. reporting_ns_detail.society_name) into a
+    getter of the value at that path
+
+    Args:
+        path (str): Dotted path
+
+    Returns:
+        Callable[[dict], Any]: Getter
+    """
+    keys = path.split(".")
+    if len(keys) == 1:
+        return itemgetter(keys[0])
+    if len(keys) == 2:
+        first, second = keys
+
+        def getter(record):
+            return record[first][second]
+
+        return getter
+
+    def getter(record):
+        for key in keys:
+            record = record[key]
+        return record
+
+    return getter
+
+
+def compile_join(path, separator, item=None):
+    """Compile a getter joining the list at a path, optionally taking a key of
+    each element of the list
+
+    Args:
+        path (str): Dotted path of list
+        separator (str): Separator to join with
+        item (Optional[str]): Key of each element to join. Defaults to None.
+
+    Returns:
+        Callable[[dict], str]: Getter
+    """
+    get_list = compile_path(path)
+    if item is None:
+
+        def getter(record):
+            return separator.join(get_list(record))
+
+        return getter
+    get_item = itemgetter(item)
+
+    def getter(record):
+        return separator.join(map(get_item, get_list(record)))
+
+    return getter
+
+
+def compile_exclude(exclude):
+    """Compile exclusions like {"status": [3]} into a function that returns
+    True for records to exclude
+
+    Args:
+        exclude (Dict[str, List]): Values to exclude by dotted path
+
+    Returns:
+        Optional[Callable[[dict], bool]]: Function or None if no exclusions
+    """
+    if not exclude:
+        return None
+    tests = tuple(
+        (compile_path(path), frozenset(values)) for path, values in exclude.items()
+    )
+
+    def excluded(record):
+        for getter, values in tests:
+            if getter(record) in values:
+                return True
+        return False
+
+    return excluded
+
+
+class FieldMapping:
+    """Field mapping of an endpoint compiled from its configuration. The
+    configuration can have:
+
+    - fields: output fields in order, each either a dotted path, a join
+      ({path, join, item}) or a derived field ({derive, from}) whose value is
+      computed by the named derivation from another output field or is None if
+      that field is missing or blank (eg. a record without a country iso3)
+    - flatten: if True, rows are all fields of the record with nested objects
+      flattened to dotted keys and fields are added to or replace them
+    - rename: fields of the record to rename (before flattening) which move to
+      the end as with a dict
+    - exclude: values by dotted path of records to leave out
+    - country: output field with the country iso3 of a row
+    - key: dotted path of the identifier of a record (eg. aid)
+
+    Args:
+        configuration (dict): Mapping configuration
+        derivations (Dict[str, Callable[[Any], Any]]): Derivations by name
+    """
+
+    def __init__(self, configuration, derivations):
+        self.country = configuration["country"]
+        key = configuration.get("key")
+        self.get_key = None if key is None else compile_path(key)
+        self.flatten = configuration.get("flatten", False)
+        self.renames = tuple(configuration.get("rename", {}).items())
+        self.excluded = compile_exclude(configuration.get("exclude"))
+        self.keys = []
+        self.getters = []
+        self.derived = []
+        for key, spec in configuration.get("fields", {}).items():
+            if isinstance(spec, str):
+                getter = compile_path(spec)
+            elif "derive" in spec:
+                getter = None
+                self.derived.append(
+                    (
+                        key,
+                        derivations[spec["derive"]],
+                        methodcaller("get", spec["from"]),
+                    )
+                )
+            elif "join" in spec:
+                getter = compile_join(spec["path"], spec["join"], spec.get("item"))
+            else:
+                raise ValueError(f"Invalid field mapping for {key}: {spec}!")
+            self.keys.append(key)
+            self.getters.append(getter)
+        self.keys = tuple(self.keys)
+        self.getters = tuple(self.getters)
+        self.extract = self.compile()
+
+    def compile(self):
+        """Compile the function that extracts a row from a record
+
+        Returns:
+            Callable[[dict], dict]: Extractor
+        """
+        keys = self.keys
+        getters = self.getters
+        derived = tuple(self.derived)
+        renames = self.renames
+        if self.flatten:
+            fields = tuple((k, g) for k, g in zip(keys, getters) if g is not None)
+
+            def extract(record):
+                for old, new in renames:
+                    record[new] = record.pop(old)
+                row = flatten(record)
+                for key, getter in fields:
+                    row[key] = getter(record)
+                for key, derivation, get_source in derived:
+                    source = get_source(row)
+                    row[key] = derivation(source) if source else None
+                return row
+
+            return extract
+
+        def no_value(record):
+            return None
+
+        getters = tuple(no_value if g is None else g for g in getters)
+
+        def extract(record):
+            row = dict(zip(keys, [getter(record) for getter in getters]))
+            for key, derivation, get_source in derived:
+                source = get_source(row)
+                row[key] = derivation(source) if source else None
+            return row
+
+        return extract
+
+    def extract_batch(self, records, keys=None):
+        """Extract rows from a batch of records (eg. the results of a page),
+        leaving out excluded records. If a list is given for keys, the key of
+        each record extracted is appended to it.
+
+        Args:
+            records (Iterable[dict]): Records
+            keys (Optional[List]): List to which to append keys. Defaults to None.
+
+        Returns:
+            List[dict]: Rows
+        """
+        extract = self.extract
+        excluded = self.excluded
+        if keys is not None:
+            if excluded is not None:
+                records = [record for record in records if not excluded(record)]
+            # keys are taken before extraction which may change the record
+            keys.extend(map(self.get_key, records))
+            return [extract(record) for record in records]
+        if excluded is None:
+            return [extract(record) for record in records]
+        return [extract(record) for record in records if not excluded(record)]
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+"""
+Page archive:
+------------
+
+Single file container of the GO API pages of a run for save/use_saved replay.
+
+"""
+
+import json
+import logging
+import mmap
+import struct
+import zlib
+from os import makedirs, replace
+from os.path import dirname
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"IFRCPAGE"
+VERSION = 1
+header = MAGIC + bytes((VERSION,))
+footer = struct.Struct(f"<Q{len(MAGIC)}s")
+
+
+class PageArchiveError(Exception):
+    pass
+
+
+class PageArchive:
+    """Archive of JSON pages in one file. Each page is compressed separately
+    with zlib and appended to the file. On closing, a compressed JSON index of
+    each page's offset, length and endpoint is appended followed by a footer
+    holding the offset of the index. For reading, the file is memory mapped and
+    only the index is decoded up front. Each page is decompressed and parsed
+    when it is requested.
+
+    Args:
+        path (str): Path of archive file
+        mode (str): "r" to read or "w" to write. Defaults to "r".
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        self.index = {}
+        self.lock = Lock()
+        if mode == "w":
+            folder = dirname(path)
+            if folder:
+                makedirs(folder, exist_ok=True)
+            self.temp_path = f"{path}.tmp"
+            self.file = open(self.temp_path, "wb")
+            self.file.write(header)
+            self.offset = len(header)
+            self.mmap = None
+        elif mode == "r":
+            self.file = open(path, "rb")
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.read_index()
+        else:
+            raise ValueError(f"Invalid mode {mode}!")
+
+    def read_index(self):
+        size = len(self.mmap)
+        if (
+            size < len(header) + footer.size
+            or self.mmap[: len(header)] != header
+            or self.mmap[size - len(MAGIC) :] != MAGIC
+        ):
+            raise PageArchiveError(f"{self.path} is not a complete page archive!")
+        index_offset, _ = footer.unpack(self.mmap[size - footer.size :])
+        self.index = json.loads(
+            zlib.decompress(self.mmap[index_offset : size - footer.size])
+        )
+
+    def add(self, filename, data, endpoint=None):
+        """Add page to archive
+
+        Args:
+            filename (str): Filename of page (eg. appeals_0.json)
+            data (Any): JSON of page
+            endpoint (Optional[str]): Endpoint of page. Defaults to None.
+
+        Returns:
+            None
+        """
+        blob = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 6)
+        with self.lock:
+            self.file.write(blob)
+            self.index[filename] = [self.offset, len(blob), endpoint]
+            self.offset += len(blob)
+
+    def __contains__(self, filename):
+        return filename in self.index
+
+    def get_size(self, filename):
+        return self.index[filename][1]
+
+    def get(self, filename):
+        """Get page from archive
+
+        Args:
+            filename (str): Filename of page (eg. appeals_0.json)
+
+        Returns:
+            Any: JSON of page
+        """
+        entry = self.index.get(filename)
+        if entry is None:
+            raise PageArchiveError(f"{filename} not in page archive {self.path}!")
+        offset, length, _ = entry
+        return json.loads(zlib.decompress(self.mmap[offset : offset + length]))
+
+    def get_endpoints(self):
+        """Get filenames of pages by endpoint in the order they were added
+
+        Returns:
+            Dict[Optional[str], List[str]]: Filenames by endpoint
+        """
+        endpoints = {}
+        for filename, (_, _, endpoint) in sorted(
+            self.index.items(), key=lambda x: x[1][0]
+        ):
+            endpoints.setdefault(endpoint, []).append(filename)
+        return endpoints
+
+    def close(self):
+        """Close archive. In write mode, the index and footer are written and
+        the archive is moved into place.
+
+        Returns:
+            None
+        """
+        if self.mode == "w":
+            with self.lock:
+                index = zlib.compress(json.dumps(self.index).encode("utf-8"))
+                self.file.write(index)
+                self.file.write(footer.pack(self.offset, MAGIC))
+                self.file.close()
+                replace(self.temp_path, self.path)
+            logger.info(f"Saved {len(self.index)} pages in {self.path}")
+        else:
+            self.mmap.close()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
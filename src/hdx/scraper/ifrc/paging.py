@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""
+Paging:
+------
+
+Adaptive page sizes and retries with jittered backoff for GO API requests.
+
+"""
+
+import json
+import logging
+import re
+from os import makedirs, replace
+from os.path import dirname, exists
+from random import uniform
+from threading import Lock
+
+from requests.exceptions import ConnectionError, HTTPError, RetryError, Timeout
+
+from hdx.scraper.ifrc.streaming import StreamError
+
+logger = logging.getLogger(__name__)
+
+limit_regex = re.compile(r"([?&])limit=\d+")
+offset_regex = re.compile(r"&offset=\d+")
+
+
+def set_limit_offset(url, limit, offset=0):
+    """Set the limit and offset query parameters of a GO API url
+
+    Args:
+        url (str): Url with limit query parameter
+        limit (int): Page size
+        offset (int): Offset of first record. Defaults to 0.
+
+    Returns:
+        str: Url with limit and offset set
+    """
+    url = limit_regex.sub(rf"\g<1>limit={limit}", url)
+    url = offset_regex.sub("", url)
+    if offset:
+        url = f"{url}&offset={offset}"
+    return url
+
+
+def is_retryable(exception):
+    """Check if a failed download is worth retrying ie. it was throttled (429),
+    failed on the server (5xx), ran out of the session's own retries, timed
+    out or a streamed page was cut short
+
+    Args:
+        exception (Exception): Exception raised by download
+
+    Returns:
+        bool: True if download should be retried, False if not
+    """
+    while exception is not None:
+        if isinstance(exception, StreamError):
+            return True
+        if isinstance(exception, HTTPError):
+            response = exception.response
+            if response is None:
+                return False
+            return response.status_code == 429 or response.status_code >= 500
+        if isinstance(exception, (RetryError, Timeout, ConnectionError)):
+            return True
+        exception = exception.__cause__
+    return False
+
+
+def get_backoff(attempt, backoff_seconds):
+    """Get exponential backoff with jitter so that concurrent feeds do not
+    retry in lockstep
+
+    Args:
+        attempt (int): Retry attempt starting from 0
+        backoff_seconds (float): Base backoff in seconds
+
+    Returns:
+        float: Seconds to wait
+    """
+    return backoff_seconds * 2**attempt * uniform(0.5, 1.5)
+
+
+class PageSizer:
+    """Adjusts the page size of an endpoint from the latency and size of the
+    pages received. The page size that would take target_seconds or reach
+    max_bytes (whichever is smaller) is estimated from each page and the page
+    size moves half way towards it, by at most a factor of 2 each page. After a
+    throttled or failed request, the page size is halved.
+
+    Args:
+        limit (int): Starting page size
+        min_limit (int): Minimum page size
+        max_limit (int): Maximum page size
+        target_seconds (float): Target latency of a page
+        max_bytes (int): Maximum size of a page in bytes
+    """
+
+    def __init__(self, limit, min_limit, max_limit, target_seconds, max_bytes):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.limit = self.clamp(limit)
+
+    def clamp(self, limit):
+        return max(self.min_limit, min(self.max_limit, int(limit)))
+
+    def observe(self, seconds, no_bytes, no_records):
+        """Adjust page size from a page received
+
+        Args:
+            seconds (float): Latency of page
+            no_bytes (int): Size of page in bytes
+            no_records (int): Number of records in page
+
+        Returns:
+            None
+        """
+        if not no_records:
+            return
+        ideal = self.max_limit
+        if seconds > 0:
+            ideal = min(ideal, self.target_seconds * no_records / seconds)
+        if no_bytes > 0:
+            ideal = min(ideal, self.max_bytes * no_records / no_bytes)
+        with self.lock:
+            limit = (self.limit + ideal) / 2
+            limit = max(self.limit / 2, min(self.limit * 2, limit))
+            self.limit = self.clamp(limit)
+
+    def shrink(self):
+        with self.lock:
+            self.limit = self.clamp(self.limit // 2)
+
+
+class PageSizeSettings:
+    """Page sizes by endpoint stored as JSON so that a run starts from the page
+    sizes tuned by the previous run. It is safe to use from multiple threads.
+
+    Args:
+        path (str): Path of settings file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.limits = {}
+        self.lock = Lock()
+        if exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.limits = json.load(f)
+
+    def get(self, endpoint, default):
+        with self.lock:
+            return self.limits.get(endpoint, default)
+
+    def set(self, endpoint, limit):
+        """Store page size of endpoint and write settings to file
+
+        Args:
+            endpoint (str): Endpoint eg. appeals
+            limit (int): Page size
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.limits.get(endpoint) != limit:
+                logger.info(f"Page size for {endpoint} tuned to {limit}")
+            self.limits[endpoint] = limit
+            folder = dirname(self.path)
+            if folder:
+                makedirs(folder, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.limits, f, indent=1, sort_keys=True)
+            replace(temp_path, self.path)
@@ -8,190 +8,1078 @@ Reads IFRC data and creates datasets.
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import timedelta
+from functools import partial
+from itertools import islice
+from math import ceil
+from os.path import getsize, join
+from threading import Lock, current_thread, local, main_thread
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlsplit
 
-from slugify import slugify
-
-from hdx.data.dataset import Dataset
-from hdx.data.showcase import Showcase
-from hdx.location.country import Country
-from hdx.utilities.dateparse import parse_date
+from hdx.scraper.ifrc.caches import RunCaches
+from hdx.scraper.ifrc.checkpoints import PageCheckpoint
+from hdx.scraper.ifrc.dates import parse_api_date
+from hdx.scraper.ifrc.deltas import DeltaIndex
+from hdx.scraper.ifrc.instrumentation import RunMetrics
+from hdx.scraper.ifrc.mappings import FieldMapping
+from hdx.scraper.ifrc.paging import (
+    PageSizer,
+    PageSizeSettings,
+    get_backoff,
+    is_retryable,
+    set_limit_offset,
+)
+from hdx.scraper.ifrc.refcache import ReferenceCache
+from hdx.scraper.ifrc.snapshot import AppealSnapshot
+from hdx.scraper.ifrc.streaming import StreamedPage, stream_page
+from hdx.scraper.ifrc.writer import ResourceWriters, get_output_writers
+from hdx.utilities.base_downloader import DownloadError
 from hdx.utilities.dictandlist import dict_of_lists_add
+from hdx.utilities.downloader import Download
 
 logger = logging.getLogger(__name__)
 
 
-def flatten(data):
-    new_data = {}
-    for key, value in data.items():
-        if not isinstance(value, dict):
-            new_data[key] = value
-        else:
-            for k, v in value.items():
-                new_data[f"{key}.{k}"] = v
-    return new_data
+def process_date(row):
+    start_date = parse_api_date(row["start_date"])
+    end_date = parse_api_date(row["end_date"])
+    society = row["country.society_name"]
+    identifier = row.get("aid")
+    if identifier:
+        identifier = f"aid = {identifier}"
+    else:
+        identifier = f"country = {row['country.name']}"
+    if end_date < start_date:
+        logger.warning(f"End date < start date for {society} {identifier}")
+        return None
+    result = {}
+    if start_date.year > 1900:
+        result["startdate"] = start_date
+    else:
+        logger.warning(f"Start date year < 1900 for {society} {identifier}")
+    if end_date.year > 1900:
+        result["enddate"] = end_date
+    else:
+        logger.warning(f"End date year < 1900 for {society} {identifier}")
+    return result
 
 
 class Pipeline:
-    def __init__(self, configuration, retriever, now, last_run_date):
+    def __init__(
+        self,
+        configuration,
+        retriever,
+        now,
+        last_run_date,
+        state_folder=None,
+        metrics=None,
+        checkpoint_folder=None,
+        page_archive=None,
+        read_only=False,
+    ):
         self.configuration = configuration
         self.retriever = retriever
         self.base_url = self.configuration["base_url"]
         self.get_params = self.configuration["get_params"]
         self.now = now
         self.last_run_date = last_run_date
-        self.iso3_to_id = {}
+        self.state_folder = state_folder
+        self.checkpoint_folder = checkpoint_folder
+        self.page_archive = page_archive
+        # state in the state folder is read but never written (eg. plan mode)
+        self.read_only = read_only
+        self._iso3_to_id = None
+        self.countries_lock = Lock()
+        self.indicators = None
+        self.page_workers = self.configuration.get("page_workers", 1)
+        self.feed_workers = self.configuration.get("feed_workers", 1)
+        self.paging = self.configuration.get("paging", {})
+        if self.paging and state_folder:
+            self.page_sizes = PageSizeSettings(
+                join(state_folder, self.paging["settings_filename"])
+            )
+        else:
+            self.page_sizes = None
+        self.thread_data = local()
+        self.caches = RunCaches()
+        self.deltas = {}
+        derivations = {"country_name": self.caches.country_name}
+        self.mappings = {
+            dataset_type: FieldMapping(
+                self.configuration[dataset_type]["mapping"], derivations
+            )
+            for dataset_type in ("appeals", "whowhatwhere")
+        }
+        if metrics is None:
+            metrics = RunMetrics()
+        self.metrics = metrics
+
+    def is_replaying(self):
+        """Whether saved pages are being replayed (from saved JSON files or a
+        page archive open for reading) rather than fetched live
+
+        Returns:
+            bool: True if replaying saved pages
+        """
+        if self.retriever.use_saved:
+            return True
+        return self.page_archive is not None and self.page_archive.mode == "r"
+
+    def is_saving(self):
+        """Whether downloaded pages are being saved (as saved JSON files or to a
+        page archive open for writing) to be replayed later
+
+        Returns:
+            bool: True if saving pages
+        """
+        if self.retriever.save:
+            return True
+        return self.page_archive is not None and self.page_archive.mode == "w"
+
+    def get_retriever(self):
+        """Get a retriever for the current thread. Retrieve and Download keep the
+        last response on the instance so each worker thread gets its own clone
+        sharing the underlying session. The main thread uses the retriever
+        passed in.
+
+        Returns:
+            Retrieve: Retriever for the current thread
+        """
+        if current_thread() is main_thread():
+            return self.retriever
+        retriever = getattr(self.thread_data, "retriever", None)
+        if retriever is None:
+            downloader = Download(session=self.retriever.downloader.session)
+            retriever = self.retriever.clone(downloader)
+            self.thread_data.retriever = retriever
+        return retriever
+
+    def download_json(self, retriever, url, filename, stage, sizer=None):
+        """Download JSON page recording its latency and size in the given stage
+        and passing them to the page sizer if given. If there is a page archive
+        open for reading, the page is read from it instead and if there is one
+        open for writing, the page is added to it.
+
+        Args:
+            retriever (Retrieve): Retriever to use
+            url (str): Url of page
+            filename (str): Filename for saved page
+            stage (str): Stage in which to record download
+            sizer (Optional[PageSizer]): Page sizer of endpoint. Defaults to None.
+
+        Returns:
+            dict: JSON of page
+        """
+        start = perf_counter()
+        page_archive = self.page_archive
+        if page_archive is not None and page_archive.mode == "r":
+            json = page_archive.get(filename)
+            no_bytes = page_archive.get_size(filename)
+        else:
+            json = retriever.download_json(url, filename=filename)
+            if retriever.use_saved:
+                no_bytes = getsize(join(retriever.saved_dir, filename))
+            else:
+                response = retriever.downloader.response
+                no_bytes = len(response.content) if response is not None else 0
+            if page_archive is not None:
+                page_archive.add(filename, json, stage.split(".")[0])
+        seconds = perf_counter() - start
+        self.metrics.add_request(stage, seconds, no_bytes)
+        if sizer is not None:
+            sizer.observe(seconds, no_bytes, len(json["results"]))
+        return json
+
+    def wait_to_retry(self, exception, attempt, filename, stage):
+        """Wait with jittered backoff before retrying a failed download,
+        counting the retry in the given stage, or raise the exception if it is
+        not worth retrying or retries have run out
+
+        Args:
+            exception (Exception): Exception raised by download
+            attempt (int): Retry attempt starting from 0
+            filename (str): Filename of page
+            stage (str): Stage in which to record retry
+
+        Returns:
+            None
+        """
+        if attempt >= self.paging.get("retries", 0) or not is_retryable(exception):
+            raise exception
+        seconds = get_backoff(attempt, self.paging["backoff_seconds"])
+        logger.warning(f"Retrying {filename} in {seconds:.1f}s: {exception}")
+        self.metrics.add(stage, retries=1)
+        sleep(seconds)
+
+    def stream_json(
+        self, url, filename, stage, sizer=None, raw_path=None, on_complete=None
+    ):
+        """Download JSON page decoding its results one at a time as they
+        arrive, waiting at most paging timeout_seconds for the response and
+        each chunk. If reading the results fails part way through, the page is
+        requested again with backoff. The raw page is written as it arrives to
+        the saved file if the retriever is saving and to raw_path if given.
+        Once the results have been iterated, the latency and size of the page
+        are recorded in the given stage and passed to the page sizer if given
+        and on_complete is called with the page.
+
+        Args:
+            url (str): Url of page
+            filename (str): Filename for saved page
+            stage (str): Stage in which to record download
+            sizer (Optional[PageSizer]): Page sizer of endpoint. Defaults to None.
+            raw_path (Optional[str]): Other path to write raw page to. Defaults to None.
+            on_complete (Optional[Callable[[StreamedPage], None]]): Called once results are iterated. Defaults to None.
 
-    def download_data(self, url, basename, add_rows_fn):
+        Returns:
+            StreamedPage: Page
+        """
+        retriever = self.get_retriever()
+        paths = []
+        if retriever.save:
+            paths.append(join(retriever.saved_dir, filename))
+        if raw_path:
+            paths.append(raw_path)
+
+        def complete(page):
+            seconds = page.seconds + page.failed_seconds + page.reader.seconds
+            no_bytes = page.reader.no_bytes
+            self.metrics.add_request(stage, seconds, no_bytes)
+            self.metrics.add(stage, streamed_pages=1)
+            if sizer is not None:
+                sizer.observe(seconds, no_bytes, page.no_records)
+            if on_complete is not None:
+                on_complete(page)
+
+        def retry(attempt, ex):
+            self.wait_to_retry(ex, attempt, filename, stage)
+
+        return stream_page(
+            retriever.downloader.session,
+            url,
+            paths,
+            complete,
+            retry,
+            self.paging.get("timeout_seconds"),
+        )
+
+    def get_page_sizer(self, endpoint, url):
+        """Get page sizer for an endpoint starting from the page size tuned by
+        the previous run or otherwise the limit in the url. There is no page
+        sizer if paging is not configured or if saved pages are being replayed.
+
+        Args:
+            endpoint (str): Endpoint eg. appeals
+            url (str): Url of first page
+
+        Returns:
+            Optional[PageSizer]: Page sizer
+        """
+        if not self.paging or self.is_replaying():
+            return None
+        limit = parse_qs(urlsplit(url).query).get("limit")
+        if not limit:
+            return None
+        limit = int(limit[0])
+        if self.page_sizes is not None:
+            limit = self.page_sizes.get(endpoint, limit)
+        return PageSizer(
+            limit,
+            self.paging["min_limit"],
+            self.paging["max_limit"],
+            self.paging["target_seconds"],
+            self.paging["max_bytes"],
+        )
+
+    @staticmethod
+    def get_page_urls(url, json):
+        """Work out the urls of the pages after the first one from the count and
+        the page size of the first page.
+
+        Args:
+            url (str): Url of first page
+            json (dict): JSON of first page
+
+        Returns:
+            List[str]: Urls of remaining pages
+        """
+        limit = parse_qs(urlsplit(url).query).get("limit")
+        if limit:
+            limit = int(limit[0])
+        else:
+            limit = len(json["results"])
+        if not limit:
+            return []
+        no_pages = ceil(json["count"] / limit)
+        return [f"{url}&offset={i * limit}" for i in range(1, no_pages)]
+
+    @staticmethod
+    def get_page_length(json):
+        """Get number of records in page. For a streamed page whose results
+        have not been read in full, this is the limit of its url.
+
+        Args:
+            json (Union[dict, StreamedPage]): JSON of page
+
+        Returns:
+            int: Number of records in page
+        """
+        if isinstance(json, StreamedPage):
+            if json.complete:
+                return json.no_records
+            limit = parse_qs(urlsplit(json.url).query).get("limit")
+            return int(limit[0]) if limit else 0
+        return len(json["results"])
+
+    def download_pages(self, url, basename, stage="download", first_page=None):
+        """Download pages in order. If page_workers is greater than 1, the
+        remaining pages are worked out from the first page and downloaded in
+        parallel. Otherwise the next url of each page is followed, downloading
+        the next page in the background while the current page is processed.
+        If there is a checkpoint folder, each page is checkpointed as it is
+        received and pages already in a checkpoint from an earlier run are
+        replayed from disk.
+
+        When following next urls, the page size adapts to the latency and size
+        of pages received and the tuned page size is stored for the next run.
+        Throttled (429) or failed (5xx) requests are retried with jittered
+        backoff, halving the page size.
+
+        If paging has stream set, live pages followed by next url are decoded
+        as they arrive and their results are an iterator that can only be
+        read once. The next page is requested once a streamed page has been
+        read. If a streamed page fails part way through, it is requested
+        again with the same backoff and its records already yielded are
+        skipped.
+
+        If the first page has already been downloaded from url, it can be
+        given as first_page and only the pages after it are downloaded.
+
+        Args:
+            url (str): Url of first page
+            basename (str): Filename template for saved pages
+            stage (str): Stage in which to record downloads. Defaults to "download".
+            first_page (Optional[dict]): JSON of first page. Defaults to None.
+
+        Returns:
+            Iterator[dict]: JSON of each page in page order
+        """
+
+        if self.checkpoint_folder:
+            checkpoint = PageCheckpoint(self.checkpoint_folder, basename, url)
+        else:
+            checkpoint = None
+        endpoint = stage.split(".")[0]
+        sizer = self.get_page_sizer(endpoint, url)
+        first_url = url
+        if sizer is not None and first_page is None:
+            url = set_limit_offset(url, sizer.limit)
+        stream = (
+            self.paging.get("stream", False)
+            and self.page_workers <= 1
+            and not self.retriever.use_saved
+            and self.page_archive is None
+        )
+
+        def checkpoint_page(i, page):
+            checkpoint.add_streamed_page(i, page["next"])
+
+        def download_page(i, page_url, offset=None):
+            if checkpoint is not None and checkpoint.has_page(i):
+                self.metrics.add(stage, replayed_pages=1)
+                return checkpoint.load_page(i)
+            filename = basename.format(index=i)
+            attempt = 0
+            while True:
+                try:
+                    if stream and checkpoint is None:
+                        json = self.stream_json(page_url, filename, stage, sizer)
+                    elif stream:
+                        json = self.stream_json(
+                            page_url,
+                            filename,
+                            stage,
+                            sizer,
+                            checkpoint.get_page_path(i),
+                            partial(checkpoint_page, i),
+                        )
+                    else:
+                        json = self.download_json(
+                            self.get_retriever(), page_url, filename, stage, sizer
+                        )
+                    break
+                except DownloadError as ex:
+                    if sizer is not None and offset is not None:
+                        sizer.shrink()
+                        page_url = set_limit_offset(first_url, sizer.limit, offset)
+                    self.wait_to_retry(ex, attempt, filename, stage)
+                    attempt += 1
+            if checkpoint is not None and not stream:
+                checkpoint.add_page(i, json)
+            return json
+
+        if first_page is None:
+            json = download_page(0, url, 0)
+        else:
+            json = first_page
+            if checkpoint is not None:
+                checkpoint.add_page(0, json)
+        if self.page_workers > 1 and json["next"]:
+            yield json
+            page_urls = self.get_page_urls(url, json)
+            with ThreadPoolExecutor(max_workers=self.page_workers) as executor:
+                yield from executor.map(
+                    download_page, range(1, len(page_urls) + 1), page_urls
+                )
+        else:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                i = 1
+                offset = 0
+                while json["next"]:
+                    streamed = isinstance(json, StreamedPage)
+                    if streamed:
+                        # streamed pages are read before the next page is
+                        # requested so that the page sizer has observed them
+                        yield json
+                    offset += self.get_page_length(json)
+                    if sizer is None:
+                        next_url = json["next"]
+                    else:
+                        next_url = set_limit_offset(first_url, sizer.limit, offset)
+                    future = executor.submit(download_page, i, next_url, offset)
+                    if not streamed:
+                        yield json
+                    json = future.result()
+                    i += 1
+                yield json
+        if checkpoint is not None:
+            checkpoint.set_complete()
+        if sizer is not None and self.page_sizes is not None and not self.read_only:
+            self.page_sizes.set(endpoint, sizer.limit)
+
+    def iterate_results(self, url, basename, stage="download"):
+        """Yield the results of every page in page order
+
+        Args:
+            url (str): Url of first page
+            basename (str): Filename template for saved pages
+            stage (str): Stage in which to record downloads. Defaults to "download".
+
+        Returns:
+            Iterator[dict]: Raw records from the GO API
+        """
+        for json in self.download_pages(url, basename, stage):
+            yield from json["results"]
+
+    def iterate_batches(self, url, basename, stage="download"):
+        """Yield the results of each page in page order. The results of
+        streamed pages are yielded in batches as they arrive.
+
+        Args:
+            url (str): Url of first page
+            basename (str): Filename template for saved pages
+            stage (str): Stage in which to record downloads. Defaults to "download".
+
+        Returns:
+            Iterator[List[dict]]: Raw records from the GO API of each page
+        """
+        for json in self.download_pages(url, basename, stage):
+            if isinstance(json, StreamedPage):
+                yield from self.get_batches(
+                    json["results"], self.paging["stream_batch_size"]
+                )
+            else:
+                yield json["results"]
+
+    @staticmethod
+    def get_batches(records, size):
+        """Split records into batches
+
+        Args:
+            records (Iterable[dict]): Records
+            size (int): Batch size
+
+        Returns:
+            Iterator[List[dict]]: Batches of records
+        """
+        records = iter(records)
+        batch = list(islice(records, size))
+        while batch:
+            yield batch
+            batch = list(islice(records, size))
+
+    @staticmethod
+    def collect_rows(rows_iterator):
+        """Collect rows yielded as (country iso3, row) into a list of all rows and
+        lists of rows by country. Rows without a country are only in the list of
+        all rows.
+
+        Args:
+            rows_iterator (Iterator[Tuple[str, dict]]): Rows with their country
+
+        Returns:
+            Tuple[List[dict], Dict[str, List[dict]]]: Rows and rows by country
+        """
         rows = []
         rows_by_country = {}
-        countries_to_update = {}
-        i = 0
-        while url:
-            filename = basename.format(index=i)
-            json = self.retriever.download_json(url, filename=filename)
-            for row in json["results"]:
-                add_rows_fn(rows, rows_by_country, row, countries_to_update)
-            url = json["next"]
-            i += 1
-        return rows, rows_by_country, countries_to_update
+        for countryiso, row in rows_iterator:
+            rows.append(row)
+            if countryiso:
+                dict_of_lists_add(rows_by_country, countryiso, row)
+        return rows, rows_by_country
+
+    @property
+    def iso3_to_id(self):
+        """Mapping of country iso3 to GO country id, which is loaded the first
+        time it is needed
+
+        Returns:
+            Dict[str, int]: Mapping of country iso3 to GO country id
+        """
+        with self.countries_lock:
+            if self._iso3_to_id is None:
+                self.get_countries()
+            return self._iso3_to_id
+
+    @iso3_to_id.setter
+    def iso3_to_id(self, iso3_to_id):
+        self._iso3_to_id = iso3_to_id
+
+    def needs_countries(self):
+        """Check if the countries reference list is needed ie. 3W is published
+        with country showcase urls that need the GO country id
+
+        Returns:
+            bool: Whether countries reference list is needed
+        """
+        dataset_info = self.configuration["whowhatwhere"]
+        if not dataset_info["publish"]:
+            return False
+        return bool(dataset_info["showcase_urls"].get("country"))
+
+    def get_countries_cache(self):
+        """Get cache of the countries reference list. There is no cache if there
+        is no state folder or if pages are being saved or replayed.
+
+        Returns:
+            Optional[ReferenceCache]: Cache of countries reference list
+        """
+        if not self.state_folder:
+            return None
+        if self.retriever.save or self.retriever.use_saved or self.page_archive:
+            return None
+        dataset_info = self.configuration["countries"]
+        return ReferenceCache(
+            join(self.state_folder, dataset_info["cache_filename"]),
+            timedelta(days=dataset_info["cache_ttl_days"]),
+        )
+
+    def revalidate_countries(self, cache, url):
+        """Make a conditional request for the first page of countries. If it
+        has changed, the JSON of the page is returned so that it does not have
+        to be downloaded again.
+
+        Args:
+            cache (ReferenceCache): Cache of countries reference list
+            url (str): Url of first page
+
+        Returns:
+            Tuple[bool, Dict[str, str], Optional[dict]]: Whether unchanged, validators of the response and JSON of page if changed
+        """
+        headers = cache.get_validators()
+        session = self.get_retriever().downloader.session
+        start = perf_counter()
+        response = session.get(
+            url, headers=headers, timeout=self.paging.get("timeout_seconds")
+        )
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if response.status_code == 304:
+            return True, validators, None
+        response.raise_for_status()
+        json = response.json()
+        self.metrics.add_request(
+            "countries.download", perf_counter() - start, len(response.content)
+        )
+        return False, validators, json
 
     def get_countries(self):
+        """Get mapping of country iso3 to GO country id. If there is a state
+        folder, the mapping is cached there and used without any request until
+        its time to live passes. It is then revalidated with a conditional
+        request and only downloaded again if it has changed, carrying on from
+        the response to the conditional request.
+
+        A conditional request can only validate one page, so it asks for pages
+        of the largest page size in paging (max_limit), which holds all the GO
+        countries. If the countries ever need more than one such page, changes
+        in pages after the first are only picked up once the first page
+        changes too.
+
+        Returns:
+            None
+        """
         dataset_info = self.configuration["countries"]
         country_path = dataset_info["url_path"]
         url = f"{self.base_url}{country_path}{self.get_params}"
         filename = dataset_info["filename"]
+        cache = self.get_countries_cache()
+        validators = {}
+        first_page = None
+        if cache is not None:
+            iso3_to_id = cache.get(self.now)
+            if iso3_to_id is None and not self.read_only:
+                if self.paging:
+                    url = set_limit_offset(url, self.paging["max_limit"])
+                unchanged, validators, first_page = self.revalidate_countries(
+                    cache, url
+                )
+                if unchanged:
+                    iso3_to_id = cache.revalidated(self.now)
+            if iso3_to_id is not None:
+                self._iso3_to_id = dict(iso3_to_id)
+                self.metrics.add("countries.cache", hits=1)
+                logger.info(f"Countries reference list: {cache.get_summary()}")
+                return
+        self._iso3_to_id = {
+            row["iso3"]: row["id"]
+            for json in self.download_pages(
+                url, filename, "countries.download", first_page
+            )
+            for row in json["results"]
+        }
+        if cache is not None and not self.read_only:
+            # stored as pairs as JSON keys can't be null
+            cache.set(list(self._iso3_to_id.items()), self.now, **validators)
+            self.metrics.add("countries.cache", misses=1)
+            logger.info(f"Countries reference list: {cache.get_summary()}")
 
-        def add_rows(rows, rows_by_country, row, countries_to_update):
-            countryiso = row["iso3"]
-            ifrc_id = row["id"]
-            rows_by_country[countryiso] = ifrc_id
+    def get_delta_index(self, dataset_type):
+        """Get index of records of dataset type as of the last run if there is
+        a state folder and the dataset type has a delta configuration
 
-        _, self.iso3_to_id, _ = self.download_data(url, filename, add_rows_fn=add_rows)
+        Args:
+            dataset_type (str): Dataset type (appeals or whowhatwhere)
 
-    def get_appealdata(self):
+        Returns:
+            Optional[DeltaIndex]: Delta index or None
+        """
+        delta = self.configuration[dataset_type].get("delta")
+        if not delta or not self.state_folder:
+            return None
+        delta_index = DeltaIndex(
+            join(self.state_folder, delta["filename"]), delta["complete"]
+        )
+        self.deltas[dataset_type] = delta_index
+        return delta_index
+
+    def finish_delta_index(self, dataset_type, delta_index, countries_to_update):
+        """Add countries affected by records added, changed or removed since the
+        last run to countries to update
+
+        Args:
+            dataset_type (str): Dataset type (appeals or whowhatwhere)
+            delta_index (DeltaIndex): Delta index
+            countries_to_update (dict): Countries to update
+
+        Returns:
+            None
+        """
+        for countryiso in delta_index.finish():
+            countries_to_update[countryiso] = True
+        logger.info(f"{dataset_type} delta: {delta_index.get_summary()}")
+        self.metrics.add(
+            f"{dataset_type}.delta",
+            seeded=delta_index.seeded,
+            added=delta_index.added,
+            changed=delta_index.changed,
+            removed=delta_index.removed,
+        )
+
+    def save_deltas(self):
+        """Save indexes of records of this run. Call once datasets are
+        published.
+
+        Returns:
+            None
+        """
+        if self.read_only:
+            return
+        for delta_index in self.deltas.values():
+            delta_index.save()
+
+    def get_appeal_rows(self, countries_to_update):
+        """Yield processed appeal rows with their country iso3 as they are
+        downloaded, filling in countries_to_update along the way. The snapshot
+        in the state folder is only used for live runs that are not saving
+        pages: replayed pages must not move its sync point and saved pages must
+        hold all appeals as a replay has no snapshot to merge them into.
+
+        Args:
+            countries_to_update (dict): Countries with appeals updated since last run
+
+        Returns:
+            Iterator[Tuple[str, dict]]: Rows with their country
+        """
         dataset_info = self.configuration["appeals"]
-        publish = dataset_info["publish"]
-        if not publish:
-            return None, None, None
         appeal_path = dataset_info["url_path"]
         additional_params = dataset_info["additional_params"]
-        url = f"{self.base_url}{appeal_path}{self.get_params}{additional_params}2020-01-01T00:00:00"
+        start_date = "2020-01-01T00:00:00"
+        snapshot = None
+        if self.state_folder and not self.is_replaying() and not self.is_saving():
+            snapshot = AppealSnapshot(
+                join(self.state_folder, dataset_info["snapshot_filename"])
+            )
+            if snapshot.synced_to:
+                start_date = snapshot.synced_to
+        url = f"{self.base_url}{appeal_path}{self.get_params}{additional_params}{start_date}"
         filename = dataset_info["filename"]
-        indicators = {}
+        indicator_columns = {
+            "start_date": [],
+            "countryiso": [],
+            "atype": [],
+            "funded": [],
+            "beneficiaries": [],
+        }
 
-        def add_row(rows, rows_by_country, row, countries_to_update):
-            status = row["status"]
-            if status == 3:  # Ignore Archived status
-                return
+        mapping = self.mappings["appeals"]
+        country_key = mapping.country
+        delta_index = self.get_delta_index("appeals")
 
-            beneficiaries = row["num_beneficiaries"]
-            row["initial_num_beneficiaries"] = beneficiaries
-            del row["num_beneficiaries"]
-            row = flatten(row)
-            startdate = parse_date(row["start_date"])
-            year_month = startdate.strftime("%Y-%m")
-            monthly_indicators = indicators.get(year_month, {})
-            countryiso = row["country.iso3"]
-            if not countryiso:  # Ignore blank country
-                logger.error(
-                    f"Missing country iso3 for appeal with aid {row['aid']} and name {row['name']}!"
+        def process_batch(records):
+            results = []
+            keys = None if delta_index is None else []
+            for i, row in enumerate(mapping.extract_batch(records, keys)):
+                countryiso = row.get(country_key)
+                if not countryiso:  # Ignore blank country
+                    logger.error(
+                        f"Missing country iso3 for appeal with aid {row['aid']} and name {row['name']}!"
+                    )
+                    continue
+                if delta_index is not None:
+                    delta_index.add(keys[i], countryiso, row)
+                if delta_index is None or delta_index.seeding:
+                    updated_date = parse_api_date(row["real_data_update"])
+                    if updated_date > self.last_run_date:
+                        countries_to_update[countryiso] = True
+                indicator_columns["start_date"].append(row["start_date"])
+                indicator_columns["countryiso"].append(countryiso)
+                indicator_columns["atype"].append(row["atype"])
+                indicator_columns["funded"].append(row["amount_funded"])
+                indicator_columns["beneficiaries"].append(
+                    row["initial_num_beneficiaries"] or 0
                 )
-                return
-            updated_date = parse_date(row["real_data_update"])
-            if updated_date > self.last_run_date:
-                countries_to_update[countryiso] = True
-            country_indicators = monthly_indicators.get(countryiso, {})
-            if row["atype"] == 0:
-                atype = "DREFs"
-            else:
-                atype = "Appeals"
-            country_indicators_atype = country_indicators.get(atype, {})
-            country_indicators_atype["number"] = (
-                country_indicators_atype.get("number", 0) + 1
+                results.append((countryiso, row))
+            return results
+
+        if snapshot is None:
+            batches = self.iterate_batches(url, filename, "appeals.download")
+        else:
+            updated, removed = snapshot.merge(
+                self.iterate_results(url, filename, "appeals.download")
             )
-            country_indicators_atype["funded"] = country_indicators_atype.get(
-                "funded", 0
-            ) + float(row["amount_funded"])
-            country_indicators_atype["beneficiaries"] = (
-                country_indicators_atype.get("beneficiaries", 0) + beneficiaries
+            logger.info(
+                f"Appeals snapshot: {updated} updated and {removed} archived since {start_date}"
             )
-            country_indicators[atype] = country_indicators_atype
-            monthly_indicators[countryiso] = country_indicators
-            indicators[year_month] = monthly_indicators
-            row["country.name"] = Country.get_country_name_from_iso3(countryiso)
-            rows.append(row)
-            dict_of_lists_add(rows_by_country, countryiso, row)
+            if not self.read_only:
+                snapshot.synced_to = self.now.strftime("%Y-%m-%dT%H:%M:%S")
+                snapshot.write()
+            batches = self.get_batches(
+                (dict(record) for record in snapshot.get_records()), 200
+            )
+        seconds = 0.0
+        no_rows = 0
+        for batch in batches:
+            start = perf_counter()
+            results = process_batch(batch)
+            seconds += perf_counter() - start
+            no_rows += len(results)
+            yield from results
+        self.metrics.add("appeals.transform", seconds, rows=no_rows)
+        if delta_index is not None:
+            self.finish_delta_index("appeals", delta_index, countries_to_update)
+        with self.metrics.time("appeals.aggregation"):
+            self.indicators = self.get_indicators(indicator_columns)
+
+    @staticmethod
+    def get_indicators(columns):
+        """Aggregate number of appeals, amount funded and beneficiaries by month,
+        country and appeal type (DREFs or Appeals) in one batch
+
+        Args:
+            columns (Dict[str, List]): Start date, country, atype, funded and beneficiaries columns
 
-        rows, rows_by_country, countries_to_update = self.download_data(
-            url, filename, add_rows_fn=add_row
+        Returns:
+            IndicatorCube: Monthly indicators
+        """
+        import numpy as np
+
+        from hdx.scraper.ifrc.indicators import IndicatorCube
+
+        start_dates, inverse = np.unique(
+            np.asarray(columns["start_date"], dtype=str), return_inverse=True
+        )
+        months = np.asarray(
+            [parse_api_date(x).strftime("%Y-%m") for x in start_dates], dtype=str
+        )
+        atypes = np.where(np.asarray(columns["atype"]) == 0, "DREFs", "Appeals")
+        return IndicatorCube.from_columns(
+            {
+                "month": months[inverse] if len(months) else months,
+                "countryiso": columns["countryiso"],
+                "atype": atypes,
+                "funded": columns["funded"],
+                "beneficiaries": columns["beneficiaries"],
+            },
+            ("month", "countryiso", "atype"),
+            ("funded", "beneficiaries"),
         )
 
-        return rows, rows_by_country, countries_to_update
+    def add_indicators_resource(self, folder, dataset):
+        """Add tidy resource of monthly indicators to dataset
 
-    def get_whowhatwheredata(self):
-        dataset_info = self.configuration["whowhatwhere"]
-        publish = dataset_info["publish"]
-        if not publish:
+        Args:
+            folder (str): Folder to write file to
+            dataset (Dataset): Dataset to which to add resource
+
+        Returns:
+            bool: True if resource added, False if not
+        """
+        if dataset is None or self.indicators is None:
+            return False
+        heading = self.configuration["appeals"]["heading"]
+        rows = self.indicators.to_rows()
+        if not rows:
+            return False
+        success, _ = dataset.generate_resource(
+            folder,
+            f"{heading.lower()}_indicators_global.csv",
+            rows,
+            {
+                "name": f"Global IFRC {heading} Monthly Indicators",
+                "description": f"Number, amount funded and beneficiaries of IFRC {heading} by month, country and appeal type",
+            },
+            list(rows[0].keys()),
+        )
+        return success
+
+    def add_output_resources(
+        self,
+        folder,
+        dataset,
+        dataset_type,
+        filename,
+        rows,
+        resourcedata,
+        countryiso=None,
+    ):
+        """Write rows to files of the extra formats in the outputs configuration
+        of the dataset type (for country datasets only if outputs has countries
+        set) and add them to dataset as resources
+
+        Args:
+            folder (str): Folder to write files to
+            dataset (Dataset): Dataset to which to add resources
+            dataset_type (str): Dataset type (appeals or whowhatwhere)
+            filename (str): Filename of CSV resource
+            rows (Iterable[dict]): Rows
+            resourcedata (dict): Resource data of CSV resource
+            countryiso (Optional[str]): Country iso3. Defaults to None (global).
+
+        Returns:
+            None
+        """
+        outputs = self.configuration[dataset_type].get("outputs")
+        writers = get_output_writers(folder, filename, outputs, countryiso)
+        if not writers:
+            return
+        for row in rows:
+            dates = process_date(row)
+            for writer in writers:
+                writer.write(row, dates)
+        for writer in writers:
+            writer.close()
+            writer.add_to_dataset(dataset, resourcedata)
+
+    def get_appealdata(self):
+        if not self.configuration["appeals"]["publish"]:
             return None, None, None
+        countries_to_update = {}
+        rows, rows_by_country = self.collect_rows(
+            self.get_appeal_rows(countries_to_update)
+        )
+        return rows, rows_by_country, countries_to_update
+
+    def get_whowhatwhere_rows(self, countries_to_update):
+        """Yield processed 3W rows with their country iso3 as they are downloaded
+
+        Args:
+            countries_to_update (dict): Countries with 3W data updated since last run
 
+        Returns:
+            Iterator[Tuple[str, dict]]: Rows with their country
+        """
+        dataset_info = self.configuration["whowhatwhere"]
         whowhatwhere_path = dataset_info["url_path"]
         additional_params = dataset_info["additional_params"]
         url = f"{self.base_url}{whowhatwhere_path}{self.get_params}{additional_params}{self.last_run_date}T00:00:00"
         filename = dataset_info["filename"]
 
-        def add_row(rows, rows_by_country, row, countries_to_update):
-            countryiso = row["project_country_detail"]["iso3"]
-            countryname = Country.get_country_name_from_iso3(countryiso)
-            district_names = ", ".join(
-                [d["name"] for d in row["project_districts_detail"]]
+        mapping = self.mappings["whowhatwhere"]
+        country_key = mapping.country
+        delta_index = self.get_delta_index("whowhatwhere")
+        seconds = 0.0
+        no_rows = 0
+        for batch in self.iterate_batches(url, filename, "whowhatwhere.download"):
+            start = perf_counter()
+            keys = None if delta_index is None else []
+            rows = mapping.extract_batch(batch, keys)
+            seconds += perf_counter() - start
+            no_rows += len(rows)
+            for i, row in enumerate(rows):
+                countryiso = row.get(country_key)
+                if not countryiso:  # Only in global dataset
+                    logger.error(
+                        f"Missing country iso3 for project with name {row['name']}!"
+                    )
+                if delta_index is not None:
+                    delta_index.add(keys[i], countryiso, row)
+                if (delta_index is None or delta_index.seeding) and countryiso:
+                    # only projects modified since the last run are downloaded
+                    countries_to_update[countryiso] = True
+                yield countryiso, row
+        self.metrics.add("whowhatwhere.transform", seconds, rows=no_rows)
+        if delta_index is not None:
+            self.finish_delta_index("whowhatwhere", delta_index, countries_to_update)
+
+    def get_whowhatwheredata(self):
+        if not self.configuration["whowhatwhere"]["publish"]:
+            return None, None, None
+        countries_to_update = {}
+        rows, rows_by_country = self.collect_rows(
+            self.get_whowhatwhere_rows(countries_to_update)
+        )
+        return rows, rows_by_country, countries_to_update
+
+    def get_rows(self, dataset_type, countries_to_update):
+        """Get iterator of processed rows with their country iso3 for a dataset
+        type
+
+        Args:
+            dataset_type (str): Dataset type (appeals or whowhatwhere)
+            countries_to_update (dict): Countries updated since last run
+
+        Returns:
+            Iterator[Tuple[str, dict]]: Rows with their country
+        """
+        if dataset_type == "appeals":
+            return self.get_appeal_rows(countries_to_update)
+        return self.get_whowhatwhere_rows(countries_to_update)
+
+    @staticmethod
+    def get_filename(heading, countryiso=None):
+        if countryiso is None:
+            return f"{heading.lower()}_data_global.csv"
+        return f"{heading.lower()}_data_{countryiso.lower()}.csv"
+
+    @staticmethod
+    def get_title_and_name(heading, countryname=None):
+        """Get title and (unslugified) name of global or country dataset
+
+        Args:
+            heading (str): Heading of dataset type
+            countryname (Optional[str]): Country name. Defaults to None (global).
+
+        Returns:
+            Tuple[str, str]: Title and name
+        """
+        if countryname is None:
+            return f"Global - IFRC {heading}", f"Global IFRC {heading} Data"
+        return (
+            f"{countryname} - IFRC {heading}",
+            f"IFRC {heading} Data for {countryname}",
+        )
+
+    def write_resources(self, folder, dataset_type):
+        """Stream rows for a dataset type from the GO API straight into CSV files
+        for the global resource and each country resource without keeping them
+        in memory, along with files of any extra formats in the outputs
+        configuration of the dataset type. The time period of each resource is
+        worked out as rows are written.
+
+        Args:
+            folder (str): Folder to write files to
+            dataset_type (str): Dataset type (appeals or whowhatwhere)
+
+        Returns:
+            Tuple[Optional[ResourceWriters], Optional[dict]]: Writers and countries to update
+        """
+        dataset_info = self.configuration[dataset_type]
+        if not dataset_info["publish"]:
+            return None, None
+        heading = dataset_info["heading"]
+        countries_to_update = {}
+        seconds = 0.0
+        country_rows = {}
+        with self.metrics.time(f"{dataset_type}.total"), self.metrics.profile():
+            with ResourceWriters(
+                folder,
+                lambda countryiso: self.get_filename(heading, countryiso),
+                process_date,
+                dataset_info.get("outputs"),
+            ) as writers:
+                for countryiso, row in self.get_rows(dataset_type, countries_to_update):
+                    start = perf_counter()
+                    writers.write(countryiso, row)
+                    seconds += perf_counter() - start
+                    country_rows[countryiso] = country_rows.get(countryiso, 0) + 1
+        self.metrics.add(
+            f"{dataset_type}.csv", seconds, rows=sum(country_rows.values())
+        )
+        for countryiso, no_rows in country_rows.items():
+            self.metrics.add(
+                f"{dataset_type}.rows", countryiso=countryiso, rows=no_rows
             )
-            societyname = row["reporting_ns_detail"]["society_name"]
-            primary_sector = row["primary_sector_display"]
-            secondary_sectors = ", ".join(row["secondary_sectors_display"])
-            programme_type = row["programme_type_display"]
-            operation_type = row["operation_type_display"]
-            status_display = row["status_display"]
-            start_date = row["start_date"]
-            end_date = row["end_date"]
-            budget_amount = row["budget_amount"]
-            actual_expenditure = row["actual_expenditure"]
-            target_male = row["target_male"]
-            target_female = row["target_female"]
-            target_other = row["target_other"]
-            target_total = row["target_total"]
-            reached_male = row["reached_male"]
-            reached_female = row["reached_female"]
-            reached_other = row["reached_other"]
-            reached_total = row["reached_total"]
-            name = row["name"]
-            row = {
-                "country.iso3": countryiso,
-                "country.name": countryname,
-                "district.names": district_names,
-                "country.society_name": societyname,
-                "primary_sector": primary_sector,
-                "secondary_sectors": secondary_sectors,
-                "programme_type": programme_type,
-                "operation_type": operation_type,
-                "status_display": status_display,
-                "start_date": start_date,
-                "end_date": end_date,
-                "budget_amount": budget_amount,
-                "actual_expenditure": actual_expenditure,
-                "target_male": target_male,
-                "target_female": target_female,
-                "target_other": target_other,
-                "target_total": target_total,
-                "reached_male": reached_male,
-                "reached_female": reached_female,
-                "reached_other": reached_other,
-                "reached_total": reached_total,
-                "name": name,
-            }
-            rows.append(row)
-            dict_of_lists_add(rows_by_country, countryiso, row)
+        return writers, countries_to_update
+
+    def fetch_all(self, folder):
+        """Download the appeals and 3W feeds and write the resources of each
+        dataset type. If feed_workers is greater than 1, the feeds are
+        downloaded at the same time unless profiling is enabled, as from Python
+        3.12 only one thread can be profiled at a time. Each feed is processed
+        exactly as it would be on its own so rows and countries to update are
+        unchanged.
+
+        The countries reference list is otherwise loaded when a 3W country
+        showcase is first built, but if pages are being saved to or replayed
+        from a page archive, it is loaded here with the feeds so that it is in
+        the archive and read before the archive is closed.
 
-        return self.download_data(url, filename, add_rows_fn=add_row)
+        Args:
+            folder (str): Folder to write files to
+
+        Returns:
+            Dict[str, Tuple[Optional[ResourceWriters], Optional[dict]]]: Writers and countries to update by dataset type
+        """
+        tasks = {
+            "appeals": partial(self.write_resources, folder, "appeals"),
+            "whowhatwhere": partial(self.write_resources, folder, "whowhatwhere"),
+        }
+        if self.page_archive is not None and self.needs_countries():
+            tasks["countries"] = partial(getattr, self, "iso3_to_id")
+        if self.feed_workers <= 1 or self.metrics.profile_enabled:
+            results = {name: task() for name, task in tasks.items()}
+        else:
+            with ThreadPoolExecutor(max_workers=self.feed_workers) as executor:
+                futures = {name: executor.submit(task) for name, task in tasks.items()}
+            results = {name: future.result() for name, future in futures.items()}
+        results.pop("countries", None)
+        return results
 
     def generate_dataset_and_showcase(
         self,
@@ -202,84 +1090,81 @@ class Pipeline:
         global_dataset=None,
     ):
         """ """
+        # imported when needed so that plan mode does not load the HDX stack
+        from hdx.data.dataset import Dataset
+        from hdx.data.showcase import Showcase
+
         if rows is None:
             return None, None
         dataset_info = self.configuration[dataset_type]
         heading = dataset_info["heading"]
-        global_name = f"Global IFRC {heading} Data"
         if countryiso is not None:
-            rows = rows.get(countryiso)
-            countryname = Country.get_country_name_from_iso3(countryiso)
+            if not isinstance(rows, ResourceWriters):
+                rows = rows.get(countryiso)
+            countryname = self.caches.country_name(countryiso)
             if countryname is None:
                 logger.error(f"Unknown ISO 3 code {countryiso}!")
                 return None, None
-            title = f"{countryname} - IFRC {heading}"
-            name = f"IFRC {heading} Data for {countryname}"
-            filename = f"{heading.lower()}_data_{countryiso.lower()}.csv"
+            title, name = self.get_title_and_name(heading, countryname)
             global_dataset_url = global_dataset.get_hdx_url()
             notes = f"There is also a [global dataset]({global_dataset_url})."
         else:
-            title = f"Global - IFRC {heading}"
-            name = global_name
-            filename = f"{heading.lower()}_data_global.csv"
+            title, name = self.get_title_and_name(heading)
             notes = "This data can also be found as individual country datasets on HDX."
 
+        filename = self.get_filename(heading, countryiso)
         logger.info(f"Creating dataset: {title}")
-        slugified_name = slugify(name).lower()
+        slugified_name = self.caches.slugify(name)
+
+        def build_template():
+            template = Dataset()
+            template.set_maintainer("196196be-6037-4488-8b71-d786adf4c081")
+            template.set_organization("3ada79f1-a239-4e09-bb2e-55743b7e6b69")
+            template.set_expected_update_frequency("Every week")
+            template.set_subnational(False)
+            template.add_tags(dataset_info["tags"])
+            return template.data
+
+        template = self.caches.get_template(("dataset", dataset_type), build_template)
         dataset = Dataset(
             {
                 "name": slugified_name,
                 "title": title,
                 "notes": notes,
+                **deepcopy(template),
             }
         )
-        dataset.set_maintainer("196196be-6037-4488-8b71-d786adf4c081")
-        dataset.set_organization("3ada79f1-a239-4e09-bb2e-55743b7e6b69")
-        dataset.set_expected_update_frequency("Every week")
-        dataset.set_subnational(False)
         if countryiso:
             dataset.add_country_location(countryiso)
         else:
             dataset.add_other_location("world")
 
-        dataset.add_tags(dataset_info["tags"])
-
         resourcedata = {
             "name": name,
             "description": f"IFRC {heading} data",
         }
 
-        def process_date(row):
-            start_date = parse_date(row["start_date"])
-            end_date = parse_date(row["end_date"])
-            society = row["country.society_name"]
-            identifier = row.get("aid")
-            if identifier:
-                identifier = f"aid = {identifier}"
-            else:
-                identifier = f"country = {row['country.name']}"
-            if end_date < start_date:
-                logger.warning(f"End date < start date for {society} {identifier}")
-                return None
-            result = {}
-            if start_date.year > 1900:
-                result["startdate"] = start_date
-            else:
-                logger.warning(f"Start date year < 1900 for {society} {identifier}")
-            if end_date.year > 1900:
-                result["enddate"] = end_date
-            else:
-                logger.warning(f"End date year < 1900 for {society} {identifier}")
-            return result
-
-        success, results = dataset.generate_resource(
-            folder,
-            filename,
-            rows,
-            resourcedata,
-            list(rows[0].keys()),
-            date_function=process_date,
-        )
+        if isinstance(rows, ResourceWriters):
+            success = rows.add_to_dataset(countryiso, dataset, resourcedata)
+        else:
+            success, results = dataset.generate_resource(
+                folder,
+                filename,
+                rows,
+                resourcedata,
+                list(rows[0].keys()),
+                date_function=process_date,
+            )
+            if success:
+                self.add_output_resources(
+                    folder,
+                    dataset,
+                    dataset_type,
+                    filename,
+                    rows,
+                    resourcedata,
+                    countryiso,
+                )
 
         if success is False:
             logger.warning(f"{name} has no data!")
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+"""
+Plan:
+----
+
+Dry run that fetches the feeds (or replays saved data) and works out which
+countries would be updated and which datasets and resources would be created
+or changed with their row counts without reading the HDX configuration, checking
+HDX access or loading the dataset, showcase and upload machinery. State in the
+state folder (eg. the appeals snapshot) is read but never written. The plan is
+printed or written as JSON.
+
+Usage:
+
+    python -m hdx.scraper.ifrc.plan --since 2025-01-01 --output plan.json
+
+"""
+
+import argparse
+import json
+import logging
+from datetime import timedelta
+from os.path import exists, expanduser, join
+
+from hdx.location.country import Country
+from hdx.scraper.ifrc.fingerprints import FingerprintIndex
+from hdx.scraper.ifrc.pagearchive import PageArchive
+from hdx.scraper.ifrc.pipeline import Pipeline, process_date
+from hdx.scraper.ifrc.writer import get_output_filenames
+from hdx.utilities.dateparse import now_utc, parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.loader import load_yaml
+from hdx.utilities.path import script_dir_plus_file, temp_dir
+from hdx.utilities.retriever import Retrieve
+from hdx.utilities.useragent import UserAgent
+
+logger = logging.getLogger(__name__)
+
+lookup = "hdx-scraper-ifrc"
+
+
+def count_rows(ifrc, dataset_type):
+    """Count the rows that would be written to each country's resource for a
+    dataset type. As when writing resources, rows without valid dates are left
+    out.
+
+    Args:
+        ifrc (Pipeline): Pipeline
+        dataset_type (str): Dataset type (appeals or whowhatwhere)
+
+    Returns:
+        Tuple[Dict[str, int], dict]: Number of rows by country and countries to update
+    """
+    countries_to_update = {}
+    counts = {}
+    for countryiso, row in ifrc.get_rows(dataset_type, countries_to_update):
+        if process_date(row) is None:
+            continue
+        counts[countryiso] = counts.get(countryiso, 0) + 1
+    return counts, countries_to_update
+
+
+def get_plan(ifrc, configuration, fingerprints=None):
+    """Work out the countries to update and the datasets that would be created
+    or changed. As in a full run, the global datasets and the datasets of every
+    country to update are regenerated if there is any country to update. A
+    dataset is created if it has never been uploaded according to fingerprints
+    and changed otherwise. Resources include those of the extra formats in the
+    outputs configuration of each dataset type.
+
+    Args:
+        ifrc (Pipeline): Pipeline
+        configuration (dict): Project configuration
+        fingerprints (Optional[FingerprintIndex]): Fingerprints of uploaded datasets. Defaults to None.
+
+    Returns:
+        dict: Plan
+    """
+    counts = {}
+    countries = set()
+    for dataset_type in ("appeals", "whowhatwhere"):
+        if not configuration[dataset_type]["publish"]:
+            continue
+        counts[dataset_type], countries_to_update = count_rows(ifrc, dataset_type)
+        countries.update(countries_to_update)
+    countries = sorted(countries)
+    datasets = []
+    if countries:
+        for dataset_type, country_counts in counts.items():
+            heading = configuration[dataset_type]["heading"]
+            for countryiso in [None] + countries:
+                if countryiso is None:
+                    no_rows = sum(country_counts.values())
+                    countryname = None
+                else:
+                    no_rows = country_counts.get(countryiso, 0)
+                    countryname = ifrc.caches.country_name(countryiso)
+                    if countryname is None:
+                        continue
+                if no_rows == 0:
+                    continue
+                title, name = Pipeline.get_title_and_name(heading, countryname)
+                name = ifrc.caches.slugify(name)
+                filename = Pipeline.get_filename(heading, countryiso)
+                resources = [{"filename": filename, "format": "csv", "rows": no_rows}]
+                for file_format, output_filename in get_output_filenames(
+                    filename, configuration[dataset_type].get("outputs"), countryiso
+                ):
+                    resources.append(
+                        {
+                            "filename": output_filename,
+                            "format": file_format,
+                            "rows": no_rows,
+                        }
+                    )
+                if fingerprints is not None and name in fingerprints.fingerprints:
+                    action = "change"
+                else:
+                    action = "create"
+                datasets.append(
+                    {
+                        "name": name,
+                        "title": title,
+                        "dataset_type": dataset_type,
+                        "countryiso": countryiso,
+                        "action": action,
+                        "resources": resources,
+                    }
+                )
+    return {
+        "since": ifrc.last_run_date.isoformat(),
+        "countries_to_update": countries,
+        "datasets": datasets,
+    }
+
+
+def main(args=None):
+    """Fetch feeds and print or write plan
+
+    Args:
+        args (Optional[List[str]]): Command line arguments. Defaults to None (sys.argv).
+
+    Returns:
+        dict: Plan
+    """
+    parser = argparse.ArgumentParser(description="Plan an IFRC run without HDX")
+    parser.add_argument(
+        "--since", help="Date of last run (default is a week ago)", default=None
+    )
+    parser.add_argument("--use-saved", action="store_true", help="Use saved data")
+    parser.add_argument("--saved-folder", default="saved_data")
+    parser.add_argument("--output", help="File to write plan to instead of printing")
+    args = parser.parse_args(args)
+
+    configuration = load_yaml(
+        script_dir_plus_file(join("config", "project_configuration.yaml"), main)
+    )
+    user_agent_config_yaml = join(expanduser("~"), ".useragents.yaml")
+    if exists(user_agent_config_yaml):
+        UserAgent.set_global(
+            user_agent_config_yaml=user_agent_config_yaml, user_agent_lookup=lookup
+        )
+    else:
+        UserAgent.set_global(lookup)
+    Country.countriesdata(use_live=False)
+    now = now_utc()
+    if args.since:
+        last_run_date = parse_date(args.since)
+    else:
+        last_run_date = now - timedelta(days=7)
+    state_folder = configuration["state_folder"]
+    fingerprints = FingerprintIndex(
+        join(state_folder, configuration["fingerprints_filename"])
+    )
+    with temp_dir("ifrc-plan", delete_on_success=True) as folder:
+        with Download() as downloader:
+            page_archive = None
+            archive_filename = configuration["page_archive"]
+            if args.use_saved and archive_filename:
+                archive_path = join(args.saved_folder, archive_filename)
+                if exists(archive_path):
+                    page_archive = PageArchive(archive_path)
+            retriever = Retrieve(
+                downloader,
+                folder,
+                args.saved_folder,
+                folder,
+                False,
+                args.use_saved and page_archive is None,
+            )
+            ifrc = Pipeline(
+                configuration,
+                retriever,
+                now,
+                last_run_date,
+                state_folder,
+                page_archive=page_archive,
+                read_only=True,
+            )
+            try:
+                plan = get_plan(ifrc, configuration, fingerprints)
+            finally:
+                if page_archive is not None:
+                    page_archive.close()
+    logger.info(
+        f"{len(plan['countries_to_update'])} countries to update, "
+        f"{len(plan['datasets'])} datasets to create or change"
+    )
+    output = json.dumps(plan, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return plan
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Publisher:
+---------
+
+Publishes per-country datasets in a bounded thread pool while storing progress
+so that a crashed run can resume.
+
+"""
+
+import logging
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from os.path import join
+from threading import Event, Lock
+
+from ratelimit import limits, sleep_and_retry
+
+from hdx.utilities.path import progress_storing_folder
+from hdx.utilities.saver import save_text
+
+logger = logging.getLogger(__name__)
+
+
+class Publisher:
+    """Run a publish function for each item of an iterator in a bounded thread
+    pool, optionally rate limited. Where to start (from WHERETOSTART or the
+    progress file) is worked out by progress_storing_folder. Progress is stored
+    in the same progress file and format, but as items can finish out of order,
+    the stored position is always the earliest item that has not yet finished.
+    A resumed run therefore starts from there and can never skip an unfinished
+    item.
+
+    Args:
+        info (dict): Dictionary containing folder in which to store progress
+        key (str): Key to examine from dictionaries from iterator
+        max_workers (int): Maximum number of items published at once. Defaults to 1.
+        rate_limit (Optional[dict]): Rate limit as {"calls": x, "period": y}. Defaults to None.
+    """
+
+    def __init__(self, info, key, max_workers=1, rate_limit=None):
+        self.info = info
+        self.key = key
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.progress_file = join(info["folder"], "progress.txt")
+        self.lock = Lock()
+
+    def get_items(self, iterator):
+        """Get items to publish taking into account where to start. Raises
+        NotFoundError if WHERETOSTART does not match any item.
+
+        Args:
+            iterator (Iterable[dict]): Items to publish
+
+        Returns:
+            List[dict]: Items to publish
+        """
+        return [
+            item for _, item in progress_storing_folder(self.info, iterator, self.key)
+        ]
+
+    def save_progress(self, current):
+        output = f"{self.key}={current}"
+        self.info["progress"] = output
+        save_text(output, self.progress_file)
+
+    def run(self, iterator, publish_fn):
+        """Call publish function on each item. If any call fails, items not yet
+        started are skipped and the exception is raised once running items
+        finish.
+
+        Args:
+            iterator (Iterable[dict]): Items to publish
+            publish_fn (Callable[[dict], None]): Function to publish an item
+
+        Returns:
+            int: Number of items published
+        """
+        items = self.get_items(iterator)
+        if not items:
+            return 0
+        if self.rate_limit:
+            publish_fn = sleep_and_retry(
+                limits(
+                    calls=self.rate_limit["calls"], period=self.rate_limit["period"]
+                )(publish_fn)
+            )
+        pending = [item[self.key] for item in items]
+        # progress_storing_folder leaves the last item as the progress
+        self.save_progress(pending[0])
+
+        failed = Event()
+
+        def publish(item):
+            if failed.is_set():
+                return
+            try:
+                publish_fn(item)
+            except Exception:
+                failed.set()
+                raise
+            current = item[self.key]
+            with self.lock:
+                pending.remove(current)
+                if pending:
+                    self.save_progress(pending[0])
+                else:
+                    self.save_progress(current)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(publish, item) for item in items]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                exception = future.exception()
+                if exception is not None:
+                    # cancel_futures of shutdown needs Python 3.9
+                    for other_future in futures:
+                        other_future.cancel()
+                    raise exception
+        return len(items)
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+"""
+Reference cache:
+---------------
+
+Local cache of reference data such as the GO country list with a time to live
+and HTTP validators for conditional requests.
+
+"""
+
+import json
+import logging
+from os import makedirs, replace
+from os.path import dirname, exists
+
+from hdx.utilities.dateparse import iso_string_from_datetime, parse_date
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """Cache of reference data stored as JSON along with when it was last
+    fetched or revalidated and the ETag and Last-Modified headers of the
+    response so that it can be revalidated with a conditional request once its
+    time to live has passed.
+
+    Args:
+        path (str): Path of cache file
+        ttl (timedelta): Time for which cached data is used without checking
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.data = None
+        self.fetched = None
+        self.etag = None
+        self.last_modified = None
+        self.hits = 0
+        self.misses = 0
+        if exists(path):
+            with open(path, encoding="utf-8") as f:
+                cache = json.load(f)
+            self.data = cache["data"]
+            self.fetched = parse_date(cache["fetched"])
+            self.etag = cache.get("etag")
+            self.last_modified = cache.get("last_modified")
+
+    def get(self, now):
+        """Get cached data if it is within its time to live, counting a hit
+
+        Args:
+            now (datetime): Current date and time
+
+        Returns:
+            Optional[Any]: Cached data or None if there is none or it has expired
+        """
+        if self.data is None or now - self.fetched > self.ttl:
+            return None
+        self.hits += 1
+        return self.data
+
+    def get_validators(self):
+        """Get headers for a conditional request for the cached data
+
+        Returns:
+            Dict[str, str]: If-None-Match and/or If-Modified-Since headers
+        """
+        headers = {}
+        if self.data is None:
+            return headers
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def revalidated(self, now):
+        """Record that the server confirmed the cached data is unchanged,
+        counting a hit
+
+        Args:
+            now (datetime): Current date and time
+
+        Returns:
+            Any: Cached data
+        """
+        self.hits += 1
+        self.fetched = now
+        self.write()
+        return self.data
+
+    def set(self, data, now, etag=None, last_modified=None):
+        """Store newly fetched data, counting a miss
+
+        Args:
+            data (Any): Data to cache
+            now (datetime): Current date and time
+            etag (Optional[str]): ETag header of response. Defaults to None.
+            last_modified (Optional[str]): Last-Modified header of response. Defaults to None.
+
+        Returns:
+            None
+        """
+        self.misses += 1
+        self.data = data
+        self.fetched = now
+        self.etag = etag
+        self.last_modified = last_modified
+        self.write()
+
+    def write(self):
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "fetched": iso_string_from_datetime(self.fetched),
+                    "etag": self.etag,
+                    "last_modified": self.last_modified,
+                    "data": self.data,
+                },
+                f,
+            )
+        replace(temp_path, self.path)
+
+    def get_summary(self):
+        return f"{self.hits} cache hits, {self.misses} cache misses"
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""
+Snapshot:
+--------
+
+Persistent local snapshot of appeals keyed by aid so that each run only needs to
+download appeals updated since the last sync.
+
+"""
+
+import gzip
+import json
+import logging
+from os import makedirs, replace
+from os.path import dirname, exists
+
+logger = logging.getLogger(__name__)
+
+
+class AppealSnapshot:
+    """Store of raw appeal records from the GO API keyed by aid. The store is
+    saved as gzipped JSON along with the time up to which it has been synced.
+
+    Args:
+        path (str): Path of snapshot file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.synced_to = None
+        self.records = {}
+        self.read()
+
+    def read(self):
+        """Read snapshot from file if it exists
+
+        Returns:
+            None
+        """
+        if not exists(self.path):
+            logger.info(f"No appeals snapshot in {self.path}")
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        self.synced_to = data["synced_to"]
+        self.records = data["records"]
+        logger.info(
+            f"Read {len(self.records)} appeals synced to {self.synced_to} from {self.path}"
+        )
+
+    def write(self):
+        """Write snapshot to file. The file is written to a temporary path first
+        so that an interrupted write does not corrupt the existing snapshot.
+
+        Returns:
+            None
+        """
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump({"synced_to": self.synced_to, "records": self.records}, f)
+        replace(temp_path, self.path)
+        logger.info(
+            f"Wrote {len(self.records)} appeals synced to {self.synced_to} to {self.path}"
+        )
+
+    def merge(self, records):
+        """Merge records into the snapshot. Records with Archived status (3) are
+        removed from the snapshot.
+
+        Args:
+            records (Iterable[dict]): Raw appeal records from the GO API
+
+        Returns:
+            Tuple[int, int]: Number of records updated and number removed
+        """
+        updated = 0
+        removed = 0
+        for record in records:
+            aid = record["aid"]
+            if record["status"] == 3:  # Remove Archived status
+                if self.records.pop(aid, None) is not None:
+                    removed += 1
+                continue
+            self.records[aid] = record
+            updated += 1
+        return updated, removed
+
+    def get_records(self):
+        """Get records in the order the GO API returns them (start date
+        descending)
+
+        Returns:
+            List[dict]: Raw appeal records
+        """
+        return sorted(
+            self.records.values(), key=lambda x: x["start_date"], reverse=True
+        )
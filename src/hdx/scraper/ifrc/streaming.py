@@ -0,0 +1,330 @@
+#!/usr/bin/python
+"""
+Streaming:
+---------
+
+Incremental decoding of GO API pages so that the records of a page can be
+processed while the rest of the page is still arriving, writing the raw page
+to any files it is saved to as it arrives.
+
+"""
+
+import json
+import logging
+from collections.abc import Mapping
+from os import makedirs, replace
+from os.path import dirname
+from time import perf_counter
+
+from requests.exceptions import RequestException
+
+from hdx.utilities.base_downloader import DownloadError
+
+try:
+    import ijson
+
+    decode_errors = (ValueError, ijson.JSONError)
+except ImportError:
+    ijson = None
+    decode_errors = (ValueError,)
+
+try:
+    from orjson import loads
+except ImportError:
+    loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+chunk_size = 65536
+start_events = frozenset(("start_map", "start_array"))
+end_events = frozenset(("end_map", "end_array"))
+
+
+class StreamError(DownloadError):
+    """Raised when the body of a streamed page cannot be read or decoded in
+    full eg. the connection is reset, stalls past the timeout or the JSON is
+    cut short"""
+
+
+class ChunkReader:
+    """File-like reader over an iterator of chunks of bytes that times how long
+    it waits for each chunk and optionally writes the chunks read to a sink as
+    they arrive. Failures reading chunks are raised as StreamError.
+
+    Args:
+        chunks (Iterator[bytes]): Chunks
+        sink (Optional[RawPageFiles]): Sink to write chunks read to. Defaults to None.
+    """
+
+    def __init__(self, chunks, sink=None):
+        self.chunks = chunks
+        self.sink = sink
+        self.buffer = b""
+        self.no_bytes = 0
+        self.seconds = 0.0
+
+    def next_chunk(self):
+        start = perf_counter()
+        try:
+            chunk = next(self.chunks, b"")
+        except (RequestException, OSError) as ex:
+            raise StreamError(f"Reading streamed page failed: {ex}") from ex
+        finally:
+            self.seconds += perf_counter() - start
+        self.no_bytes += len(chunk)
+        if self.sink is not None and chunk:
+            self.sink.write(chunk)
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = [self.buffer]
+            self.buffer = b""
+            while chunk := self.next_chunk():
+                data.append(chunk)
+            return b"".join(data)
+        if not self.buffer:
+            self.buffer = self.next_chunk()
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+
+class RawPageFiles:
+    """Files to which the raw bytes of a page are written as they arrive so
+    that they are never held in memory. The files are written under temporary
+    names, started again each time the page is requested again and only moved
+    into place once the page is complete.
+
+    Args:
+        paths (Sequence[str]): Paths of files
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.files = []
+
+    def open(self):
+        """Open (or start again) the temporary files
+
+        Returns:
+            RawPageFiles: Self
+        """
+        self.close()
+        for path in self.paths:
+            folder = dirname(path)
+            if folder:
+                makedirs(folder, exist_ok=True)
+            self.files.append(open(f"{path}.tmp", "wb"))
+        return self
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        self.files = []
+
+    def finish(self):
+        """Close the temporary files and move them into place
+
+        Returns:
+            None
+        """
+        self.close()
+        for path in self.paths:
+            replace(f"{path}.tmp", path)
+
+
+class StreamedPage(Mapping):
+    """GO API page decoded as it arrives. The fields before the results (count,
+    next and previous in the GO API) are decoded when the page is created and
+    results gives an iterator of the records, each decoded when it is reached.
+    Once the results have been iterated, on_complete is called with the
+    page. If the results come before other fields, they are decoded in full
+    up front. Without ijson, the whole page is decoded (with orjson if
+    installed).
+
+    If reading the results fails part way through the page, on_error is called
+    with the number of the attempt (counted over the whole page) and the
+    StreamError and should raise it to give up or return (eg. after a backoff)
+    to retry. The page is then opened again and the records already yielded
+    are skipped. Failures while the page is being created are raised.
+
+    stream_page sets url to the url of the page and seconds to the time spent
+    waiting for responses to start.
+
+    Args:
+        open_reader (Callable[[], ChunkReader]): Function that requests page and returns reader of it
+        on_complete (Optional[Callable[[StreamedPage], None]]): Called once results are iterated. Defaults to None.
+        on_error (Optional[Callable[[int, StreamError], None]]): Called when reading results fails. Defaults to None.
+    """
+
+    def __init__(self, open_reader, on_complete=None, on_error=None):
+        self.open_reader = open_reader
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.no_records = 0
+        self.complete = False
+        self.url = None
+        self.seconds = 0.0
+        self.failed_seconds = 0.0
+        self.attempt = 0
+        self.open()
+
+    def open(self):
+        """Request page and decode the fields before the results
+
+        Returns:
+            None
+        """
+        self.reader = self.open_reader()
+        self.fields = {}
+        self.results = None
+        try:
+            if ijson is None:
+                data = loads(self.reader.read())
+                self.results = data.pop("results")
+                self.fields = data
+                self.events = None
+                return
+            self.events = ijson.parse(self.reader, use_float=True)
+            for prefix, event, value in self.events:
+                if prefix == "results" and event == "start_array":
+                    break
+                if "." not in prefix and event not in start_events and prefix:
+                    if event != "map_key":
+                        self.fields[prefix] = value
+            if "next" not in self.fields:
+                self.results = list(self.iterate_records())
+        except decode_errors as ex:
+            raise StreamError(f"Decoding streamed page failed: {ex}") from ex
+
+    def iterate_records(self):
+        builder = None
+        depth = 0
+        for prefix, event, value in self.events:
+            if depth == 0:
+                if event == "end_array" and prefix == "results":
+                    break
+                if event in start_events:
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                    depth = 1
+                else:
+                    yield value
+                continue
+            builder.event(event, value)
+            if event in start_events:
+                depth += 1
+            elif event in end_events:
+                depth -= 1
+                if depth == 0:
+                    yield builder.value
+        for prefix, event, value in self.events:
+            if "." not in prefix and prefix and event not in start_events:
+                if event not in end_events and event != "map_key":
+                    self.fields[prefix] = value
+
+    def iterate_remaining(self):
+        if self.results is None:
+            records = self.iterate_records()
+        else:
+            records = iter(self.results)
+        skip = self.no_records
+        try:
+            for record in records:
+                if skip:
+                    skip -= 1
+                    continue
+                self.no_records += 1
+                yield record
+        except decode_errors as ex:
+            raise StreamError(f"Decoding streamed page failed: {ex}") from ex
+
+    def reopen(self, ex):
+        while True:
+            if self.on_error is None:
+                raise ex
+            self.on_error(self.attempt, ex)
+            self.attempt += 1
+            self.failed_seconds += self.reader.seconds
+            try:
+                self.open()
+                return
+            except DownloadError as reopen_ex:
+                ex = reopen_ex
+
+    def iterate_results(self):
+        while True:
+            try:
+                yield from self.iterate_remaining()
+                break
+            except StreamError as ex:
+                self.reopen(ex)
+        self.complete = True
+        if self.on_complete is not None:
+            self.on_complete(self)
+
+    def __getitem__(self, key):
+        if key == "results":
+            return self.iterate_results()
+        return self.fields[key]
+
+    def __iter__(self):
+        yield from self.fields
+        yield "results"
+
+    def __len__(self):
+        return len(self.fields) + 1
+
+
+def stream_page(session, url, paths=(), on_complete=None, on_error=None, timeout=None):
+    """Request GO API page and start decoding it as it arrives
+
+    Args:
+        session (requests.Session): Session to use
+        url (str): Url of page
+        paths (Sequence[str]): Paths of files to write the raw page to as it arrives. Defaults to ().
+        on_complete (Optional[Callable[[StreamedPage], None]]): Called once results are iterated. Defaults to None.
+        on_error (Optional[Callable[[int, StreamError], None]]): Called when reading results fails. Defaults to None.
+        timeout (Optional[float]): Seconds to wait for the response to start and for each chunk. Defaults to None.
+
+    Returns:
+        StreamedPage: Page
+    """
+    responses = []
+    request_seconds = [0.0]
+    raw_files = RawPageFiles(paths) if paths else None
+
+    def open_reader():
+        for response in responses:
+            response.close()
+        responses.clear()
+        start = perf_counter()
+        try:
+            response = session.get(url, stream=True, timeout=timeout)
+            response.raise_for_status()
+        except RequestException as ex:
+            raise DownloadError(f"Setup of Streaming Download of {url} failed!") from ex
+        finally:
+            request_seconds[0] += perf_counter() - start
+        responses.append(response)
+        sink = None if raw_files is None else raw_files.open()
+        return ChunkReader(response.iter_content(chunk_size), sink)
+
+    def close(page):
+        for response in responses:
+            response.close()
+        if raw_files is not None:
+            raw_files.finish()
+        page.seconds = request_seconds[0]
+        if on_complete is not None:
+            on_complete(page)
+
+    page = StreamedPage(open_reader, close, on_error)
+    page.url = url
+    page.seconds = request_seconds[0]
+    return page
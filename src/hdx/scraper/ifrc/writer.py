@@ -0,0 +1,430 @@
+#!/usr/bin/python
+"""
+Writer:
+------
+
+Writes rows to CSV resources as they arrive rather than holding them in memory,
+optionally also to gzip compressed CSV and Parquet resources.
+
+"""
+
+import csv
+import gzip
+import io
+import logging
+from importlib.util import find_spec
+from os.path import join, splitext
+
+from hdx.scraper.ifrc.dates import parse_api_date
+from hdx.utilities.dateparse import default_date, default_enddate
+
+logger = logging.getLogger(__name__)
+
+
+class CSVResourceWriter:
+    """Write rows to a CSV file one at a time, working out the time period of the
+    file as rows are written. Like Dataset.generate_resource, the headers are
+    taken from the first row and rows whose dates are None are skipped. The file
+    is only created once there is a row to write.
+
+    Args:
+        folder (str): Folder to write file to
+        filename (str): Filename of file
+        check_dates (bool): Whether resource must have dates. Defaults to True.
+    """
+
+    file_format = "csv"
+    name_suffix = ""
+
+    def __init__(self, folder, filename, check_dates=True):
+        self.filename = filename
+        self.path = join(folder, filename)
+        self.check_dates = check_dates
+        self.headers = None
+        self.file = None
+        self.writer = None
+        self.no_rows = 0
+        self.startdate = default_enddate
+        self.enddate = default_date
+
+    def write(self, row, dates):
+        """Write row to file updating time period from dates of row
+
+        Args:
+            row (dict): Row to write
+            dates (Optional[dict]): Dates of row in keys startdate and enddate or None to skip row
+
+        Returns:
+            bool: True if row written, False if skipped
+        """
+        if self.headers is None:
+            self.headers = list(row.keys())
+        if dates is None:
+            return False
+        startdate = dates.get("startdate")
+        if startdate is not None and startdate < self.startdate:
+            self.startdate = startdate
+        enddate = dates.get("enddate")
+        if enddate is not None and enddate > self.enddate:
+            self.enddate = enddate
+        if self.file is None:
+            self.open()
+        self.write_row(row)
+        self.no_rows += 1
+        return True
+
+    def open(self):
+        self.file = open(self.path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow(self.headers)
+
+    def write_row(self, row):
+        self.writer.writerow([row.get(header) for header in self.headers])
+
+    def close(self):
+        """Close file if open
+
+        Returns:
+            None
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def add_to_dataset(self, dataset, resourcedata):
+        """Create resource from written file, add it to dataset and set the time
+        period of the dataset. The resource is not added if HDX has no file
+        format to which its format maps.
+
+        Args:
+            dataset (Dataset): Dataset to which to add resource
+            resourcedata (dict): Resource data
+
+        Returns:
+            bool: True if resource added, False if no rows, dates or format
+        """
+        from hdx.data.resource import Resource
+
+        if self.no_rows == 0:
+            logger.error(f"No data rows in {self.filename}!")
+            return False
+        file_format = Resource.get_mapped_format(
+            self.file_format, configuration=dataset.configuration
+        )
+        if file_format is None:
+            logger.error(
+                f"HDX has no file format {self.file_format} for {self.filename}!"
+            )
+            return False
+        if self.check_dates:
+            if self.startdate == default_enddate or self.enddate == default_date:
+                logger.error(f"No dates in {self.filename}!")
+                return False
+            dataset.set_time_period(self.startdate, self.enddate)
+        if self.name_suffix:
+            resourcedata = {
+                **resourcedata,
+                "name": f"{resourcedata['name']} {self.name_suffix}",
+            }
+        resource = Resource(resourcedata)
+        resource.set_format(file_format)
+        resource.set_file_to_upload(self.path)
+        dataset.add_update_resource(resource)
+        return True
+
+
+class GzipCSVResourceWriter(CSVResourceWriter):
+    """Write rows to a gzip compressed CSV file one at a time. The file has no
+    timestamp so that the same rows always give the same file.
+
+    Args:
+        folder (str): Folder to write file to
+        filename (str): Filename of file
+        check_dates (bool): Whether resource must have dates. Defaults to True.
+    """
+
+    file_format = "csv.gz"
+    name_suffix = "(gzipped CSV)"
+
+    def open(self):
+        compressed = gzip.GzipFile(self.path, "wb", compresslevel=6, mtime=0)
+        self.file = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow(self.headers)
+
+
+def convert_int(value):
+    if isinstance(value, int):
+        return value
+    return int(float(value))
+
+
+def convert_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() == "true"
+
+
+def convert_datetime(value):
+    return parse_api_date(str(value))
+
+
+class ParquetResourceWriter(CSVResourceWriter):
+    """Write rows to a Parquet file in row groups of batch_size rows. Columns
+    are typed from column_types (int, float, bool or datetime) and other columns
+    are strings. Values that cannot be converted and empty strings are written
+    as nulls. Needs pyarrow.
+
+    Args:
+        folder (str): Folder to write file to
+        filename (str): Filename of file
+        check_dates (bool): Whether resource must have dates. Defaults to True.
+        column_types (Optional[Dict[str, str]]): Type by column. Defaults to None.
+        batch_size (int): Number of rows in each row group. Defaults to 10000.
+    """
+
+    file_format = "parquet"
+    name_suffix = "(Parquet)"
+    types = {
+        "int": (convert_int, "int64"),
+        "float": (float, "float64"),
+        "bool": (convert_bool, "bool_"),
+        "datetime": (convert_datetime, "timestamp"),
+    }
+
+    def __init__(
+        self, folder, filename, check_dates=True, column_types=None, batch_size=10000
+    ):
+        super().__init__(folder, filename, check_dates)
+        self.column_types = column_types or {}
+        self.batch_size = batch_size
+        self.schema = None
+        self.converters = None
+        self.columns = None
+
+    def open(self):
+        # imported when needed as it is optional and slow to import
+        import pyarrow
+        import pyarrow.parquet
+
+        fields = []
+        self.converters = []
+        for header in self.headers:
+            column_type = self.column_types.get(header)
+            if column_type is None:
+                converter, arrow_type = str, pyarrow.string()
+            else:
+                converter, name = self.types[column_type]
+                if name == "timestamp":
+                    arrow_type = pyarrow.timestamp("ms", tz="UTC")
+                else:
+                    arrow_type = getattr(pyarrow, name)()
+            fields.append(pyarrow.field(header, arrow_type))
+            self.converters.append(converter)
+        self.schema = pyarrow.schema(fields)
+        self.columns = [[] for _ in self.headers]
+        self.file = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+    def write_row(self, row):
+        for header, converter, column in zip(
+            self.headers, self.converters, self.columns
+        ):
+            value = row.get(header)
+            if value is None or value == "":
+                column.append(None)
+                continue
+            try:
+                column.append(converter(value))
+            except (ValueError, TypeError, OverflowError):
+                column.append(None)
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        import pyarrow
+
+        if not self.columns or not self.columns[0]:
+            return
+        table = pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(column, field.type)
+                for column, field in zip(self.columns, self.schema)
+            ],
+            schema=self.schema,
+        )
+        self.file.write_table(table)
+        self.columns = [[] for _ in self.headers]
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+def get_output_filenames(filename, outputs, countryiso=None):
+    """Get the extra formats (csv.gz and parquet) and their filenames for a CSV
+    file. For a country file, there are only extra formats if outputs has
+    countries set. Parquet is left out with a warning if pyarrow is not
+    installed.
+
+    Args:
+        filename (str): Filename of CSV file
+        outputs (Optional[dict]): Outputs configuration with formats
+        countryiso (Optional[str]): Country iso3. Defaults to None (global).
+
+    Returns:
+        List[Tuple[str, str]]: Formats and filenames
+    """
+    if not outputs:
+        return []
+    if countryiso is not None and not outputs.get("countries"):
+        return []
+    filenames = []
+    for file_format in outputs.get("formats", []):
+        if file_format == "csv.gz":
+            filenames.append((file_format, f"{filename}.gz"))
+        elif file_format == "parquet":
+            if find_spec("pyarrow") is None:
+                logger.warning(
+                    f"pyarrow is not installed so no Parquet for {filename}!"
+                )
+                continue
+            filenames.append((file_format, f"{splitext(filename)[0]}.parquet"))
+        else:
+            raise ValueError(f"Unknown output format {file_format}!")
+    return filenames
+
+
+def get_output_writers(folder, filename, outputs, countryiso=None, check_dates=True):
+    """Get writers for the extra formats (csv.gz and parquet) of a CSV file as
+    given by get_output_filenames
+
+    Args:
+        folder (str): Folder to write files to
+        filename (str): Filename of CSV file
+        outputs (Optional[dict]): Outputs configuration with formats and column_types
+        countryiso (Optional[str]): Country iso3. Defaults to None (global).
+        check_dates (bool): Whether resources must have dates. Defaults to True.
+
+    Returns:
+        List[CSVResourceWriter]: Writers
+    """
+    writers = []
+    for file_format, output_filename in get_output_filenames(
+        filename, outputs, countryiso
+    ):
+        if file_format == "csv.gz":
+            writer = GzipCSVResourceWriter(folder, output_filename, check_dates)
+        else:
+            writer = ParquetResourceWriter(
+                folder, output_filename, check_dates, outputs.get("column_types")
+            )
+        writers.append(writer)
+    return writers
+
+
+class ResourceWriters:
+    """Writers for a global CSV file and one CSV file per country, so that a
+    stream of rows is partitioned into all of them in a single pass. The date
+    function is called once per row and its result used for both the global
+    file and the file of the row's country. Country files are opened when the
+    first row for the country arrives.
+
+    If outputs has formats, the rows of the global file (and of country files if
+    outputs has countries set) are also written to files of those formats.
+
+    Args:
+        folder (str): Folder to write files to
+        filename_function (Callable[[Optional[str]], str]): Function giving filename from country iso3 (None for global)
+        date_function (Optional[Callable[[dict], Optional[dict]]]): Date function to call for each row. Defaults to None.
+        outputs (Optional[dict]): Outputs configuration. Defaults to None.
+    """
+
+    def __init__(self, folder, filename_function, date_function=None, outputs=None):
+        self.folder = folder
+        self.filename_function = filename_function
+        self.date_function = date_function
+        self.outputs = outputs
+        self.writers = {}
+        self.output_writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_writer(self, countryiso=None):
+        """Get writer for country creating it if needed
+
+        Args:
+            countryiso (Optional[str]): Country iso3. Defaults to None (global).
+
+        Returns:
+            CSVResourceWriter: Writer for country
+        """
+        writer = self.writers.get(countryiso)
+        if writer is None:
+            filename = self.filename_function(countryiso)
+            check_dates = self.date_function is not None
+            writer = CSVResourceWriter(self.folder, filename, check_dates)
+            self.writers[countryiso] = writer
+            self.output_writers[countryiso] = get_output_writers(
+                self.folder, filename, self.outputs, countryiso, check_dates
+            )
+        return writer
+
+    def write(self, countryiso, row):
+        """Write row to global file and to file of its country if it has one
+
+        Args:
+            countryiso (Optional[str]): Country iso3
+            row (dict): Row to write
+
+        Returns:
+            None
+        """
+        if self.date_function is None:
+            dates = {}
+        else:
+            dates = self.date_function(row)
+        keys = (None, countryiso) if countryiso else (None,)
+        for key in keys:
+            self.get_writer(key).write(row, dates)
+            for writer in self.output_writers.get(key, ()):
+                writer.write(row, dates)
+
+    def get(self, countryiso=None):
+        return self.writers.get(countryiso)
+
+    def countries(self):
+        return [x for x in self.writers if x is not None]
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        for writers in self.output_writers.values():
+            for writer in writers:
+                writer.close()
+
+    def add_to_dataset(self, countryiso, dataset, resourcedata):
+        """Add resource for country (or global if None) to dataset followed by
+        the resources of any extra formats
+
+        Args:
+            countryiso (Optional[str]): Country iso3 or None for global
+            dataset (Dataset): Dataset to which to add resource
+            resourcedata (dict): Resource data
+
+        Returns:
+            bool: True if resource added, False if not
+        """
+        writer = self.get(countryiso)
+        if writer is None:
+            return False
+        if not writer.add_to_dataset(dataset, resourcedata):
+            return False
+        for writer in self.output_writers.get(countryiso, ()):
+            writer.add_to_dataset(dataset, resourcedata)
+        return True
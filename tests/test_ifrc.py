@@ -4,20 +4,49 @@ Unit tests for InterAction.
 
 """
 
-from os.path import join
+import gzip
+import random
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from os import listdir, makedirs, remove
+from os.path import abspath, exists, getsize, join
+from pathlib import Path
+from pstats import Stats
 
 import pytest
+import requests
+
+from benchmarks.goapi import GOAPIServer
+from benchmarks.synthetic import generate_projects, get_countries
 
 from hdx.api.configuration import Configuration
 from hdx.api.locations import Locations
+from hdx.data.dataset import Dataset
+from hdx.data.resource import Resource
 from hdx.data.vocabulary import Vocabulary
 from hdx.location.country import Country
+from hdx.scraper.ifrc import streaming
+from hdx.scraper.ifrc.checkpoints import PageCheckpoint
+from hdx.scraper.ifrc.dates import parse_api_date
+from hdx.scraper.ifrc.fingerprints import FingerprintIndex, get_fingerprint
+from hdx.scraper.ifrc.instrumentation import RunMetrics
+from hdx.scraper.ifrc.mappings import FieldMapping
+from hdx.scraper.ifrc.pagearchive import PageArchive, PageArchiveError
 from hdx.scraper.ifrc.pipeline import Pipeline
+from hdx.scraper.ifrc.plan import get_plan
+from hdx.scraper.ifrc.publisher import Publisher
+from hdx.scraper.ifrc.snapshot import AppealSnapshot
+from hdx.scraper.ifrc.writer import ResourceWriters
 from hdx.utilities.compare import assert_files_same
 from hdx.utilities.dateparse import parse_date
 from hdx.utilities.downloader import Download
-from hdx.utilities.path import temp_dir
+from hdx.utilities.loader import load_json, load_text
+from hdx.utilities.path import NotFoundError, temp_dir
 from hdx.utilities.retriever import Retrieve
+from hdx.utilities.saver import save_json, save_text
 from hdx.utilities.useragent import UserAgent
 
 
@@ -171,3 +200,1294 @@ class TestIFRC:
                     join(fixtures, filename), resource.get_file_to_upload()
                 )
                 assert showcase is None
+
+    def test_download_pages_parallel(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_parallel", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                ifrc.get_countries()
+                expected = ifrc.iso3_to_id
+                assert len(expected) == 232
+
+                configuration["page_workers"] = 4
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                ifrc.get_countries()
+                assert ifrc.iso3_to_id == expected
+                assert list(ifrc.iso3_to_id) == list(expected)
+                url = "https://goadmin.ifrc.org/api/v2/country/?limit=200&format=json"
+                assert ifrc.get_page_urls(url, {"count": 281, "results": []}) == [
+                    f"{url}&offset=200"
+                ]
+
+    def test_appeals_snapshot(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_snapshot", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            state_folder = join(folder, "state")
+            snapshot_path = join(state_folder, "appeals_snapshot.json.gz")
+            with Download() as downloader:
+                # replayed pages do not touch the snapshot
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                    state_folder,
+                )
+                rows, _, _ = ifrc.get_appealdata()
+                assert len(rows) == 144
+                assert not exists(snapshot_path)
+
+                with GOAPIServer.from_fixtures(input_folder) as server:
+                    configuration["base_url"] = server.base_url
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                        state_folder,
+                    )
+                    rows, country_rows, countries_to_update = ifrc.get_appealdata()
+                    assert len(rows) == 144
+                    assert len(country_rows["BDI"]) == 1
+                    assert len(countries_to_update) == 44
+                    ifrc.save_deltas()
+
+                    snapshot = AppealSnapshot(snapshot_path)
+                    assert snapshot.synced_to == "2023-03-01T00:00:00"
+                    assert len(snapshot.records) == 144
+                    record = dict(snapshot.records["17693"])
+                    record["status"] = 3
+                    assert snapshot.merge([record]) == (0, 1)
+                    assert "17693" not in snapshot.records
+
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-08"),
+                        parse_date("2023-03-01"),
+                        state_folder,
+                    )
+                    new_rows, _, countries_to_update = ifrc.get_appealdata()
+                    assert list(new_rows) == list(rows)
+                    assert len(countries_to_update) == 0
+                    # only appeals updated since the sync point are fetched
+                    path = server.requests[-1]["path"]
+                    assert path.endswith("__gte=2023-03-01T00:00:00")
+
+                    # saved pages hold all appeals for replays without a snapshot
+                    saved_folder = join(folder, "saved")
+                    retriever = Retrieve(
+                        downloader, folder, saved_folder, folder, True, False
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-15"),
+                        parse_date("2023-03-08"),
+                        state_folder,
+                    )
+                    saved_rows, _, _ = ifrc.get_appealdata()
+                    assert list(saved_rows) == list(rows)
+                    path = server.requests[-1]["path"]
+                    assert path.endswith("__gte=2020-01-01T00:00:00")
+                    saved = load_json(join(saved_folder, "appeals_0.json"))
+                    assert len(saved["results"]) == len(server.endpoints["appeal"])
+                    snapshot = AppealSnapshot(snapshot_path)
+                    assert snapshot.synced_to == "2023-03-08T00:00:00"
+
+    def test_delta_index(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_deltas", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            state_folder = join(folder, "state")
+            appeals = load_json(join(input_folder, "appeals_0.json"))
+            saved_folder = join(folder, "saved")
+            makedirs(saved_folder)
+
+            def get_appealdata(results):
+                # replace snapshot so removed appeals are not kept
+                snapshot_path = join(state_folder, "appeals_snapshot.json.gz")
+                if exists(snapshot_path):
+                    remove(snapshot_path)
+                appeals["results"] = results
+                save_json(appeals, join(saved_folder, "appeals_0.json"))
+                with Download() as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, saved_folder, folder, False, True
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-08"),
+                        parse_date("2023-03-01"),
+                        state_folder,
+                    )
+                    _, _, countries_to_update = ifrc.get_appealdata()
+                    ifrc.save_deltas()
+                    return ifrc.deltas["appeals"], sorted(countries_to_update)
+
+            # first run seeds index and updates countries by date
+            results = deepcopy(appeals["results"])
+            bdi = [x for x in results if x["country"]["iso3"] == "BDI"][0]
+            bdi["real_data_update"] = "2023-03-05 10:00:00+00:00"
+            delta_index, countries = get_appealdata(results)
+            assert (delta_index.seeded, delta_index.added) == (144, 0)
+            assert countries == ["BDI"]
+            delta_index, countries = get_appealdata(results)
+            assert not delta_index.seeding
+            assert (delta_index.added, delta_index.changed) == (0, 0)
+            assert countries == []
+
+            # exported timestamps count as changes
+            bdi["real_data_update"] = "2023-03-06 10:00:00+00:00"
+            delta_index, countries = get_appealdata(results)
+            assert (delta_index.added, delta_index.changed) == (0, 1)
+            assert countries == ["BDI"]
+
+            bdi["amount_funded"] = "1.00"
+            delta_index, countries = get_appealdata(results)
+            assert delta_index.changed == 1
+            assert countries == ["BDI"]
+
+            removed = [x for x in results if x["status"] != 3 and x["country"]["iso3"]][
+                -1
+            ]
+            results.remove(removed)
+            delta_index, countries = get_appealdata(results)
+            assert delta_index.removed == 1
+            assert countries == [removed["country"]["iso3"]]
+            index = load_json(join(state_folder, "appeals_index.json"))
+            assert len(index) == 143
+            assert index[bdi["aid"]][0] == "BDI"
+
+            # 3W projects seen since the last run update their countries
+            configuration["whowhatwhere"]["publish"] = True
+            projects = generate_projects(3, get_countries(), random.Random(0))
+            save_json(
+                {"count": 3, "next": None, "previous": None, "results": projects},
+                join(saved_folder, "whowhatwhere_0.json"),
+            )
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, saved_folder, folder, False, True
+                )
+                for state in (None, state_folder):
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-08"),
+                        parse_date("2023-03-01"),
+                        state,
+                    )
+                    _, _, countries_to_update = ifrc.get_whowhatwheredata()
+                    assert sorted(countries_to_update) == sorted(
+                        {x["project_country_detail"]["iso3"] for x in projects}
+                    )
+                ifrc.save_deltas()
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-15"),
+                    parse_date("2023-03-08"),
+                    state_folder,
+                )
+                _, _, countries_to_update = ifrc.get_whowhatwheredata()
+                assert countries_to_update == {}
+
+    def test_write_resources(self, configuration, fixtures, input_folder):
+        with temp_dir(
+            "test_ifrc_stream", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                writers, countries_to_update = ifrc.write_resources(folder, "appeals")
+                assert len(countries_to_update) == 44
+                assert len(writers.countries()) == 44
+                assert writers.get().no_rows == 144
+                assert ifrc.write_resources(folder, "whowhatwhere") == (None, None)
+                for filename in ("appeals_data_global.csv", "appeals_data_bdi.csv"):
+                    assert_files_same(join(fixtures, filename), join(folder, filename))
+
+                Locations.set_validlocations(
+                    [{"name": x, "title": x} for x in ("world", "bdi")]
+                )
+                appeals_dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals"
+                )
+                assert (
+                    appeals_dataset["dataset_date"]
+                    == "[1993-03-08T00:00:00 TO 2028-02-29T23:59:59]"
+                )
+                dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals", "BDI", appeals_dataset
+                )
+                assert (
+                    dataset["dataset_date"]
+                    == "[2022-11-16T00:00:00 TO 2023-03-31T23:59:59]"
+                )
+                resource = dataset.get_resource()
+                assert resource["name"] == "IFRC Appeals Data for Burundi"
+                assert resource.get_file_to_upload() == join(
+                    folder, "appeals_data_bdi.csv"
+                )
+
+    def test_output_formats(self, configuration, fixtures, input_folder):
+        pyarrow = pytest.importorskip("pyarrow.parquet")
+        assert configuration["appeals"]["outputs"]["formats"] == []
+        configuration["appeals"]["outputs"]["formats"] = ["csv.gz", "parquet"]
+        with temp_dir(
+            "test_ifrc_outputs", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                writers, _ = ifrc.write_resources(folder, "appeals")
+                Locations.set_validlocations(
+                    [{"name": x, "title": x} for x in ("world", "bdi")]
+                )
+                dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals"
+                )
+                resources = dataset.get_resources()
+                assert [x["format"] for x in resources] == ["csv", "csv.gz", "parquet"]
+                assert resources[1]["name"] == "Global IFRC Appeals Data (gzipped CSV)"
+                filename = "appeals_data_global.csv"
+                with gzip.open(join(folder, f"{filename}.gz"), "rt") as f:
+                    with open(join(fixtures, filename)) as expected:
+                        assert f.read() == expected.read()
+                table = pyarrow.read_table(join(folder, "appeals_data_global.parquet"))
+                assert table.num_rows == 144
+                assert str(table.schema.field("amount_funded").type) == "double"
+                assert str(table.schema.field("aid").type) == "int64"
+                assert (
+                    str(table.schema.field("start_date").type)
+                    == "timestamp[ms, tz=UTC]"
+                )
+                assert str(table.schema.field("name").type) == "string"
+                row = table.slice(0, 1).to_pylist()[0]
+                assert row["amount_funded"] == 299929.0
+                assert row["start_date"] == parse_date("2023-02-26")
+                dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals", "BDI", dataset
+                )
+                assert len(dataset.get_resources()) == 1
+
+                # rows held in memory give the same files
+                gz_file = join(folder, f"{filename}.gz")
+                with open(gz_file, "rb") as f:
+                    compressed = f.read()
+                remove(gz_file)
+                appeal_rows, _, _ = ifrc.get_appealdata()
+                dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, appeal_rows, "appeals"
+                )
+                assert len(dataset.get_resources()) == 3
+                with open(gz_file, "rb") as f:
+                    assert f.read() == compressed
+
+                # formats HDX does not know are not added
+                formats = Resource.read_formats_mappings()
+                Resource.set_formatsdict(
+                    {k: v for k, v in formats.items() if v != "parquet"}
+                )
+                dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals"
+                )
+                assert [x["format"] for x in dataset.get_resources()] == [
+                    "csv",
+                    "csv.gz",
+                ]
+                Resource.set_formatsdict(formats)
+
+    def test_fetch_all(self, configuration, fixtures, input_folder):
+        with temp_dir(
+            "test_ifrc_fetch_all", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                configuration["feed_workers"] = 3
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                results = ifrc.fetch_all(folder)
+                assert len(ifrc.iso3_to_id) == 232
+                assert list(results) == ["appeals", "whowhatwhere"]
+                writers, countries_to_update = results["appeals"]
+                assert len(countries_to_update) == 44
+                assert writers.get().no_rows == 144
+                assert results["whowhatwhere"] == (None, None)
+                for filename in ("appeals_data_global.csv", "appeals_data_bdi.csv"):
+                    assert_files_same(join(fixtures, filename), join(folder, filename))
+
+    def test_missing_country(self, configuration, input_folder):
+        projects = generate_projects(3, get_countries(), random.Random(0))
+        for project in projects:
+            project["modified_at"] = "2023-02-15T00:00:00Z"
+        projects[1]["project_country_detail"]["iso3"] = None
+        configuration["whowhatwhere"]["publish"] = True
+        with temp_dir(
+            "test_ifrc_missing_country", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with GOAPIServer.from_fixtures(input_folder) as server:
+                server.endpoints["project"] = projects
+                appeals = server.endpoints["appeal"]
+                appeals[0] = deepcopy(appeals[0])
+                appeals[0]["country"]["iso3"] = None
+                configuration["base_url"] = server.base_url
+                with Download() as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                    )
+                    # appeals without a country are left out
+                    writers, _ = ifrc.write_resources(folder, "appeals")
+                    assert writers.get().no_rows == 143
+                    # projects without a country are only in the global file
+                    writers, countries_to_update = ifrc.write_resources(
+                        folder, "whowhatwhere"
+                    )
+                    assert writers.get().no_rows == 3
+                    assert None not in countries_to_update
+                    rows, rows_by_country, _ = ifrc.get_whowhatwheredata()
+                    assert rows[1]["country.name"] is None
+                    assert None not in rows_by_country
+                    assert sum(len(x) for x in rows_by_country.values()) == 2
+
+    def test_plan(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_plan", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                fingerprints = FingerprintIndex(join(folder, "fingerprints.json"))
+                fingerprints.set("ifrc-appeals-data-for-burundi", "abc")
+                plan = get_plan(ifrc, configuration, fingerprints)
+                assert plan["since"] == "2023-02-01T00:00:00+00:00"
+                assert len(plan["countries_to_update"]) == 44
+                datasets = plan["datasets"]
+                assert len(datasets) == 45
+                assert datasets[0] == {
+                    "name": "global-ifrc-appeals-data",
+                    "title": "Global - IFRC Appeals",
+                    "dataset_type": "appeals",
+                    "countryiso": None,
+                    "action": "create",
+                    "resources": [
+                        {
+                            "filename": "appeals_data_global.csv",
+                            "format": "csv",
+                            "rows": 144,
+                        },
+                    ],
+                }
+                burundi = [x for x in datasets if x["countryiso"] == "BDI"][0]
+                assert burundi["action"] == "change"
+                assert burundi["resources"] == [
+                    {"filename": "appeals_data_bdi.csv", "format": "csv", "rows": 1}
+                ]
+
+                outputs = deepcopy(configuration["appeals"]["outputs"])
+                configuration["appeals"]["outputs"]["formats"] = ["csv.gz", "parquet"]
+                plan = get_plan(ifrc, configuration, fingerprints)
+                assert plan["datasets"][0]["resources"][1:] == [
+                    {
+                        "filename": "appeals_data_global.csv.gz",
+                        "format": "csv.gz",
+                        "rows": 144,
+                    },
+                    {
+                        "filename": "appeals_data_global.parquet",
+                        "format": "parquet",
+                        "rows": 144,
+                    },
+                ]
+                configuration["appeals"]["outputs"] = outputs
+
+            # plan mode runs without loading the HDX dataset machinery
+            plan_path = join(folder, "plan.json")
+            code = (
+                "import sys; from hdx.scraper.ifrc.plan import main; "
+                f"main(['--use-saved', '--saved-folder', {repr(abspath(input_folder))}, "
+                f"'--since', '2023-02-01', '--output', 'plan.json']); "
+                "assert not [x for x in sys.modules if x.startswith('hdx.data')]"
+            )
+            subprocess.run([sys.executable, "-c", code], cwd=folder, check=True)
+            burundi["action"] = "create"
+            assert load_json(plan_path)["datasets"] == datasets
+            assert not exists(join(folder, "saved_state"))
+
+            # a live plan reads the state folder without changing it
+            state_folder = join(folder, "state")
+
+            def get_state():
+                state = {}
+                for filename in sorted(listdir(state_folder)):
+                    with open(join(state_folder, filename), "rb") as f:
+                        state[filename] = f.read()
+                return state
+
+            with GOAPIServer.from_fixtures(input_folder) as server:
+                configuration["base_url"] = server.base_url
+                with Download() as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                        state_folder,
+                    )
+                    ifrc.get_countries()
+                    ifrc.get_appealdata()
+                    ifrc.save_deltas()
+                    state = get_state()
+                    assert list(state) == [
+                        "appeals_index.json",
+                        "appeals_snapshot.json.gz",
+                        "countries_cache.json",
+                        "page_sizes.json",
+                    ]
+                    # countries cache has expired by now
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-20"),
+                        parse_date("2023-03-01"),
+                        state_folder,
+                        read_only=True,
+                    )
+                    ifrc.get_countries()
+                    plan = get_plan(ifrc, configuration)
+                    ifrc.save_deltas()
+                    assert plan["countries_to_update"] == []
+                    assert get_state() == state
+
+    def test_page_checkpoints(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_checkpoints", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            checkpoint_folder = join(folder, "checkpoints")
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                    checkpoint_folder=checkpoint_folder,
+                )
+                download_json = ifrc.download_json
+                downloaded = []
+
+                def fail_on_second_page(retriever, url, filename, stage, sizer=None):
+                    if filename == "countries_1.json":
+                        raise requests.ConnectionError("Timed out")
+                    downloaded.append(filename)
+                    return download_json(retriever, url, filename, stage)
+
+                ifrc.download_json = fail_on_second_page
+                with pytest.raises(requests.ConnectionError):
+                    ifrc.get_countries()
+                assert downloaded == ["countries_0.json"]
+                manifest = load_json(
+                    join(checkpoint_folder, "countries_checkpoint.json")
+                )
+                assert list(manifest["pages"]) == ["0"]
+                assert manifest["complete"] is False
+
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                    checkpoint_folder=checkpoint_folder,
+                )
+                downloaded = []
+
+                def record(retriever, url, filename, stage, sizer=None):
+                    downloaded.append(filename)
+                    return download_json(retriever, url, filename, stage)
+
+                ifrc.download_json = record
+                ifrc.get_countries()
+                assert downloaded == ["countries_1.json"]
+                assert len(ifrc.iso3_to_id) == 232
+                assert ifrc.metrics.stages["countries.download"]["replayed_pages"] == 1
+                manifest = load_json(
+                    join(checkpoint_folder, "countries_checkpoint.json")
+                )
+                assert list(manifest["pages"]) == ["0", "1"]
+                assert manifest["pages"]["1"] is None
+                assert manifest["complete"] is True
+
+                url = manifest["url"]
+                checkpoint = PageCheckpoint(
+                    checkpoint_folder, "countries_{index}.json", url
+                )
+                assert checkpoint.has_page(1)
+                checkpoint = PageCheckpoint(
+                    checkpoint_folder, "countries_{index}.json", f"{url}&x=1"
+                )
+                assert checkpoint.pages == {}
+
+    def test_page_archive(self, configuration, fixtures, input_folder):
+        with temp_dir(
+            "test_ifrc_archive", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            path = join(folder, "saved_data", "pages.archive")
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                with PageArchive(path, "w") as page_archive:
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                        page_archive=page_archive,
+                    )
+                    ifrc.get_countries()
+                    ifrc.write_resources(folder, "appeals")
+                expected = ifrc.iso3_to_id
+                input_size = sum(
+                    getsize(join(input_folder, filename))
+                    for filename in ("countries_0.json", "countries_1.json")
+                ) + getsize(join(input_folder, "appeals_0.json"))
+                assert getsize(path) < input_size / 5
+
+                retriever = Retrieve(
+                    downloader, folder, join(folder, "missing"), folder, False, True
+                )
+                with PageArchive(path) as page_archive:
+                    assert page_archive.get_endpoints() == {
+                        "countries": ["countries_0.json", "countries_1.json"],
+                        "appeals": ["appeals_0.json"],
+                    }
+                    assert page_archive.get("appeals_0.json") == load_json(
+                        join(input_folder, "appeals_0.json")
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                        page_archive=page_archive,
+                    )
+                    ifrc.get_countries()
+                    assert ifrc.iso3_to_id == expected
+                    remove(join(folder, "appeals_data_global.csv"))
+                    ifrc.write_resources(folder, "appeals")
+                    assert_files_same(
+                        join(fixtures, "appeals_data_global.csv"),
+                        join(folder, "appeals_data_global.csv"),
+                    )
+                    with pytest.raises(PageArchiveError):
+                        page_archive.get("appeals_1.json")
+                with open(path, "r+b") as f:
+                    f.truncate(getsize(path) - 1)
+                with pytest.raises(PageArchiveError):
+                    PageArchive(path)
+
+    def test_page_archive_countries(self, configuration, input_folder):
+        projects = generate_projects(3, get_countries(), random.Random(0))
+        for project in projects:
+            project["modified_at"] = "2023-02-15T00:00:00Z"
+        configuration["whowhatwhere"]["publish"] = True
+        with temp_dir(
+            "test_ifrc_archive_countries",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as folder:
+            path = join(folder, "pages.archive")
+            with Download() as downloader:
+                retriever = Retrieve(downloader, folder, folder, folder, False, False)
+
+                def run(page_archive):
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        parse_date("2023-02-01"),
+                        page_archive=page_archive,
+                    )
+                    ifrc.fetch_all(folder)
+                    page_archive.close()
+                    # country showcases are built after the archive is closed
+                    assert len(ifrc.iso3_to_id) == 232
+                    return ifrc
+
+                with GOAPIServer.from_fixtures(input_folder) as server:
+                    server.endpoints["project"] = projects
+                    configuration["base_url"] = server.base_url
+                    expected = run(PageArchive(path, "w")).iso3_to_id
+                page_archive = PageArchive(path)
+                assert "countries" in page_archive.get_endpoints()
+                assert run(page_archive).iso3_to_id == expected
+
+    def test_countries_cache(self, configuration, input_folder):
+        # two pages of countries, the first validated by a conditional request
+        configuration["paging"]["max_limit"] = 200
+        with GOAPIServer.from_fixtures(input_folder, etag='"v1"') as server:
+            configuration["base_url"] = server.base_url
+            with temp_dir(
+                "test_ifrc_countries_cache",
+                delete_on_success=True,
+                delete_on_failure=False,
+            ) as folder:
+                with Download() as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+
+                    def get_pipeline(now):
+                        return Pipeline(
+                            configuration,
+                            retriever,
+                            parse_date(now),
+                            parse_date("2023-02-01"),
+                            folder,
+                        )
+
+                    ifrc = get_pipeline("2023-03-01")
+                    assert server.requests == []
+                    assert len(ifrc.iso3_to_id) == 232
+                    # first page of conditional request is reused
+                    assert [x["offset"] for x in server.requests] == [0, 200]
+                    assert server.requests[0]["limit"] == 200
+                    assert ifrc.metrics.stages["countries.download"]["pages"] == 2
+                    assert ifrc.metrics.stages["countries.cache"]["misses"] == 1
+                    cache = load_json(join(folder, "countries_cache.json"))
+                    assert cache["etag"] == '"v1"'
+                    expected = ifrc.iso3_to_id
+
+                    server.requests.clear()
+                    ifrc = get_pipeline("2023-03-05")
+                    assert ifrc.iso3_to_id == expected
+                    assert server.requests == []
+                    assert ifrc.metrics.stages["countries.cache"]["hits"] == 1
+
+                    ifrc = get_pipeline("2023-03-20")
+                    assert ifrc.iso3_to_id == expected
+                    assert server.get_statuses() == [304]
+                    assert ifrc.metrics.stages["countries.cache"]["hits"] == 1
+                    cache = load_json(join(folder, "countries_cache.json"))
+                    assert cache["fetched"].startswith("2023-03-20")
+
+    def test_adaptive_paging(self, configuration, input_folder):
+        configuration["paging"]["backoff_seconds"] = 0.01
+        with GOAPIServer.from_fixtures(input_folder, failures=[503, 429]) as server:
+            records = server.endpoints["country"]
+            with temp_dir(
+                "test_ifrc_paging", delete_on_success=True, delete_on_failure=False
+            ) as folder:
+                with Download(retry_attempts=0) as downloader:
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+
+                    def get_results():
+                        ifrc = Pipeline(
+                            configuration,
+                            retriever,
+                            parse_date("2023-03-01"),
+                            parse_date("2023-02-01"),
+                            folder,
+                        )
+                        results = ifrc.iterate_results(
+                            url, "countries_{index}.json", "countries.download"
+                        )
+                        return ifrc, list(results)
+
+                    def get_limits():
+                        return [
+                            x["limit"] for x in server.requests if x["status"] == 200
+                        ]
+
+                    url = f"{server.base_url}country/?limit=200&format=json"
+                    ifrc, results = get_results()
+                    assert results == records
+                    assert ifrc.metrics.stages["countries.download"]["retries"] == 2
+                    # halved twice after failures and then grown on fast pages
+                    assert get_limits() == [50, 100, 200]
+                    page_sizes = load_json(join(folder, "page_sizes.json"))
+                    assert page_sizes == {"countries": 400}
+
+                    server.requests.clear()
+                    _, results = get_results()
+                    assert results == records
+                    assert get_limits() == [400]
+
+    def test_goapi_server(self, configuration, input_folder):
+        projects = generate_projects(300, get_countries(), random.Random(0))
+        last_run_date = parse_date("2023-02-01")
+        expected_projects = sum(
+            1 for x in projects if x["modified_at"] >= "2023-02-01T00:00:00"
+        )
+        assert 0 < expected_projects < len(projects)
+        configuration["get_params"] = "/?limit=50&format=json"
+        configuration["whowhatwhere"]["publish"] = True
+        configuration["paging"]["backoff_seconds"] = 0.01
+        with temp_dir(
+            "test_ifrc_goapi", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download(retry_attempts=0) as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                expected_appeals, _, _ = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    last_run_date,
+                ).get_appealdata()
+                expected_appeals = list(expected_appeals)
+
+                def run(server, page_workers, state_folder=None):
+                    configuration["base_url"] = server.base_url
+                    configuration["page_workers"] = page_workers
+                    retriever = Retrieve(
+                        downloader, folder, folder, folder, False, False
+                    )
+                    ifrc = Pipeline(
+                        configuration,
+                        retriever,
+                        parse_date("2023-03-01"),
+                        last_run_date,
+                        state_folder,
+                    )
+                    appeals, _, _ = ifrc.get_appealdata()
+                    whowhatwhere, _, _ = ifrc.get_whowhatwheredata()
+                    assert list(appeals) == expected_appeals
+                    assert len(whowhatwhere) == expected_projects
+                    return ifrc
+
+                with GOAPIServer.from_fixtures(
+                    input_folder,
+                    latency=0.01,
+                    bandwidth=1000000,
+                    failures=[429, 503, 429],
+                ) as server:
+                    server.endpoints["project"] = projects
+                    ifrc = run(server, 3)
+                    statuses = server.get_statuses()
+                    assert statuses[:3] == [429, 503, 429]
+                    assert ifrc.metrics.stages["appeals.download"]["retries"] == 3
+                    no_appeals = len(server.endpoints["appeal"])
+                    no_pages = -(-no_appeals // 50) + -(-expected_projects // 50)
+                    assert statuses.count(200) == no_pages
+                    offsets = sorted(
+                        x["offset"]
+                        for x in server.requests
+                        if x["status"] == 200 and "/appeal/" in x["path"]
+                    )
+                    assert offsets == list(range(0, no_appeals, 50))
+
+                with GOAPIServer.from_fixtures(
+                    input_folder, throttle_rate=0.2, failure_rate=0.1, seed=1
+                ) as server:
+                    server.endpoints["project"] = projects
+                    ifrc = run(server, 1, join(folder, "state"))
+                    statuses = server.get_statuses()
+                    assert 429 in statuses
+                    assert 503 in statuses
+                    retries = sum(
+                        stage.get("retries", 0)
+                        for stage in ifrc.metrics.stages.values()
+                    )
+                    assert retries == len(statuses) - statuses.count(200)
+
+    def test_streamed_pages(self, configuration, input_folder, monkeypatch):
+        configuration["get_params"] = "/?limit=50&format=json"
+        configuration["page_workers"] = 1
+        with temp_dir(
+            "test_ifrc_streaming", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with GOAPIServer.from_fixtures(input_folder) as server:
+                configuration["base_url"] = server.base_url
+                dataset_info = configuration["appeals"]
+                url = (
+                    f"{server.base_url}{dataset_info['url_path']}"
+                    f"{configuration['get_params']}"
+                    f"{dataset_info['additional_params']}2020-01-01T00:00:00"
+                )
+                expected = requests.get(url).json()
+                with requests.Session() as session:
+                    for backend in (streaming.ijson, None):
+                        monkeypatch.setattr(streaming, "ijson", backend)
+                        completed = []
+                        path = join(folder, "raw", "page.json")
+                        page = streaming.stream_page(
+                            session, url, [path], completed.append
+                        )
+                        assert page["count"] == expected["count"]
+                        assert page["next"] == expected["next"]
+                        assert completed == []
+                        assert list(page["results"]) == expected["results"]
+                        assert completed == [page]
+                        assert page.no_records == 50
+                        assert load_json(path) == expected
+                        assert not exists(f"{path}.tmp")
+                monkeypatch.undo()
+
+                def run(stream, save):
+                    configuration["paging"]["stream"] = stream
+                    saved_folder = join(folder, f"saved_{stream}")
+                    with Download(retry_attempts=0) as downloader:
+                        retriever = Retrieve(
+                            downloader, folder, saved_folder, folder, save, False
+                        )
+                        ifrc = Pipeline(
+                            configuration,
+                            retriever,
+                            parse_date("2023-03-01"),
+                            parse_date("2023-02-01"),
+                            checkpoint_folder=join(folder, f"checkpoint_{stream}"),
+                        )
+                        appeals, _, _ = ifrc.get_appealdata()
+                        return list(appeals), ifrc.metrics.stages, saved_folder
+
+                expected_appeals, stages, _ = run(False, False)
+                appeals, stages, saved_folder = run(True, True)
+                assert appeals == expected_appeals
+                page = load_json(join(saved_folder, "appeals_0.json"))
+                assert page == expected
+                checkpoint = PageCheckpoint(
+                    join(folder, "checkpoint_True"), "appeals_{index}.json", url
+                )
+                assert checkpoint.complete is True
+                no_pages = len(checkpoint.pages)
+                assert stages["appeals.download"]["streamed_pages"] == no_pages
+
+                # pages cut off part way through are requested again
+                configuration["paging"]["backoff_seconds"] = 0.01
+                server.truncations = 2
+                checkpoint_folder = join(folder, "checkpoint_True")
+                shutil.rmtree(checkpoint_folder)
+                appeals, truncated_stages, _ = run(True, False)
+                assert appeals == expected_appeals
+                assert truncated_stages["appeals.download"]["retries"] == 2
+                assert server.truncations == 0
+                assert checkpoint.load_page(0) == expected
+
+    def test_run_caches(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_caches", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                rows, rows_by_country, _ = ifrc.get_appealdata()
+                caches = ifrc.caches
+                stats = caches.get_stats()["country_name"]
+                assert stats["misses"] == stats["size"] == len(rows_by_country)
+                assert stats["hits"] == len(rows) - len(rows_by_country)
+
+                countries = sorted(rows_by_country)[:2]
+                Locations.set_validlocations(
+                    [{"name": x.lower(), "title": x.lower()} for x in countries]
+                    + [{"name": "world", "title": "world"}]
+                )
+                global_dataset, _ = ifrc.generate_dataset_and_showcase(
+                    folder, rows, "appeals"
+                )
+                datasets = [
+                    ifrc.generate_dataset_and_showcase(
+                        folder, rows_by_country, "appeals", countryiso, global_dataset
+                    )[0]
+                    for countryiso in countries
+                ]
+                assert caches.get_stats()["templates"] == {
+                    "hits": 2,
+                    "misses": 1,
+                    "size": 1,
+                }
+                assert datasets[0]["tags"] == global_dataset["tags"]
+                assert datasets[0]["groups"] != datasets[1]["groups"]
+                assert "groups" not in caches.templates[("dataset", "appeals")]
+
+                path = join(
+                    "src",
+                    "hdx",
+                    "scraper",
+                    "ifrc",
+                    "config",
+                    "hdx_appeals_dataset.yaml",
+                )
+                expected = Dataset(dict(datasets[0].data))
+                expected.update_from_yaml(path)
+                for dataset in datasets:
+                    caches.update_from_yaml(dataset, path)
+                assert datasets[0].data == expected.data
+                assert caches.get_stats()["load_yaml"]["misses"] == 1
+                assert caches.get_stats()["load_yaml"]["hits"] == 1
+
+                metrics = RunMetrics()
+                caches.add_to_metrics(metrics)
+                assert metrics.stages["cache.templates"]["hits"] == 2
+                assert "templates 2 hits/1 misses" in caches.get_summary()
+
+    def test_run_metrics(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_metrics", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                metrics = RunMetrics(profile=True)
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                    metrics=metrics,
+                )
+                ifrc.get_countries()
+                # Profiled on a worker thread as when feeds run in parallel
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    executor.submit(ifrc.write_resources, folder, "appeals").result()
+                stages = metrics.stages
+                assert stages["countries.download"]["pages"] == 2
+                assert stages["appeals.download"]["pages"] == 1
+                assert stages["appeals.download"]["bytes"] == getsize(
+                    join(input_folder, "appeals_0.json")
+                )
+                assert (
+                    sum(stages["appeals.download"]["latency_histogram"].values()) == 1
+                )
+                assert stages["appeals.transform"]["rows"] == 144
+                assert stages["appeals.csv"]["rows"] == 144
+                assert stages["appeals.aggregation"]["calls"] == 1
+                assert stages["appeals.total"]["peak_rss_increase_bytes"] >= 0
+                assert "peak_rss_bytes" not in stages["appeals.total"]
+                assert stages["appeals.rows"]["rows"] == 144
+                assert metrics.countries["BDI"]["appeals.rows"]["rows"] == 1
+                with metrics.time("hdx_upload", "BDI", datasets=1):
+                    pass
+                metrics.add_latency("hdx_upload", 0.3, "BDI")
+                assert metrics.countries["BDI"]["hdx_upload"]["datasets"] == 1
+                assert metrics.countries["BDI"]["hdx_upload"]["latency_histogram"] == {
+                    "0.5": 1
+                }
+                assert stages["hdx_upload"]["calls"] == 1
+
+                path = metrics.write(folder, version="1.0")
+                report = load_json(path)
+                assert report["version"] == "1.0"
+                assert report["stages"]["appeals.csv"]["rows"] == 144
+                assert "BDI" in report["countries"]
+                stats = Stats(join(folder, "run_profile.prof"))
+                assert any(function[2] == "get_appeal_rows" for function in stats.stats)
+
+    def test_resource_writers(self):
+        with temp_dir(
+            "test_ifrc_writers", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            calls = []
+
+            def date_function(row):
+                calls.append(row["id"])
+                if row["id"] == 2:
+                    return None
+                return {"startdate": parse_date(row["date"])}
+
+            with ResourceWriters(
+                folder,
+                lambda countryiso: f"{countryiso or 'global'}.csv",
+                date_function,
+            ) as writers:
+                writers.write("AFG", {"id": 1, "date": "2023-01-02"})
+                writers.write("BDI", {"id": 2, "date": "2023-01-03"})
+                writers.write("AFG", {"id": 3, "date": "2022-12-01"})
+            assert calls == [1, 2, 3]
+            assert writers.get().no_rows == 2
+            assert writers.get().startdate == parse_date("2022-12-01")
+            assert writers.get("AFG").no_rows == 2
+            assert writers.get("BDI").no_rows == 0
+            assert writers.countries() == ["AFG", "BDI"]
+            with open(join(folder, "global.csv")) as f:
+                assert f.read() == "id,date\n1,2023-01-02\n3,2022-12-01\n"
+
+            # rows without a country are only written to the global file
+            with ResourceWriters(
+                folder, lambda countryiso: f"{countryiso or 'global'}.csv"
+            ) as writers:
+                writers.write("AFG", {"a": 1})
+                writers.write(None, {"a": 2})
+            assert writers.countries() == ["AFG"]
+            with open(join(folder, "global.csv")) as f:
+                assert f.read() == "a\n1\n2\n"
+
+    def test_parse_api_date(self):
+        for string in (
+            "2023-02-26T00:00:00Z",
+            "2023-02-27 14:20:05+00:00",
+            "2023-02-28 00:46:59.047725+00:00",
+            "2023-02-27T14:20:05+02:00",
+            "2023-02-28",
+            "0001-01-01T00:00:00Z",
+            "28/02/2023",
+        ):
+            assert parse_api_date(string) == parse_date(string)
+
+    def test_publisher(self):
+        # the GO API stand-in answers POST like the CKAN action API of HDX
+        server = GOAPIServer({}, latency=0.05).start()
+        url = f"{server.base_url}action/package_create"
+        countries = [{"iso3": x} for x in ("AFG", "BDI", "COD", "ETH", "SDN")]
+
+        def publish_fn(country):
+            countryiso = country["iso3"]
+            if countryiso == fail_on:
+                raise ValueError(countryiso)
+            response = requests.post(url, json={"name": countryiso})
+            assert response.json()["success"] is True
+
+        def get_names():
+            return [x["body"]["name"] for x in server.requests]
+
+        try:
+            with temp_dir(
+                "test_ifrc_publisher", delete_on_success=True, delete_on_failure=False
+            ) as folder:
+                info = {"folder": Path(folder)}
+                progress_file = join(folder, "progress.txt")
+                fail_on = None
+                publisher = Publisher(info, "iso3", 4, {"calls": 100, "period": 1})
+                assert publisher.run(countries, publish_fn) == 5
+                assert sorted(get_names()) == [x["iso3"] for x in countries]
+                assert server.max_active > 1
+                assert load_text(progress_file) == "iso3=SDN"
+                remove(progress_file)
+
+                server.requests.clear()
+                fail_on = "COD"
+                publisher = Publisher(info, "iso3")
+                with pytest.raises(ValueError):
+                    publisher.run(countries, publish_fn)
+                assert get_names() == ["AFG", "BDI"]
+                assert load_text(progress_file) == "iso3=COD"
+
+                server.requests.clear()
+                fail_on = None
+                assert publisher.run(countries, publish_fn) == 3
+                assert get_names() == ["COD", "ETH", "SDN"]
+
+                save_text("iso3=XXX", progress_file)
+                with pytest.raises(NotFoundError):
+                    publisher.run(countries, publish_fn)
+        finally:
+            server.stop()
+
+    def test_fingerprints(self, configuration, fixtures, input_folder):
+        with temp_dir(
+            "test_ifrc_fingerprints", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                writers, _ = ifrc.write_resources(folder, "appeals")
+                Locations.set_validlocations([{"name": "world", "title": "world"}])
+                dataset, showcase = ifrc.generate_dataset_and_showcase(
+                    folder, writers, "appeals"
+                )
+                fingerprint = get_fingerprint(dataset, showcase)
+                assert get_fingerprint(dataset, showcase) == fingerprint
+                assert get_fingerprint(dataset) != fingerprint
+
+                path = join(folder, "state", "fingerprints.json")
+                index = FingerprintIndex(path)
+                name = dataset["name"]
+                assert index.check(name, fingerprint) is True
+                index.set(name, fingerprint)
+                index.write()
+
+                index = FingerprintIndex(path)
+                assert index.check(name, fingerprint) is False
+                with open(join(folder, "appeals_data_global.csv"), "a") as f:
+                    f.write("\n")
+                assert index.check(name, get_fingerprint(dataset, showcase)) is True
+                assert (
+                    index.get_summary()
+                    == "1 datasets uploaded, 1 unchanged uploads avoided"
+                )
+
+    def test_indicators(self, configuration, input_folder):
+        with temp_dir(
+            "test_ifrc_indicators", delete_on_success=True, delete_on_failure=False
+        ) as folder:
+            with Download() as downloader:
+                retriever = Retrieve(
+                    downloader, folder, input_folder, folder, False, True
+                )
+                ifrc = Pipeline(
+                    configuration,
+                    retriever,
+                    parse_date("2023-03-01"),
+                    parse_date("2023-02-01"),
+                )
+                rows, _, _ = ifrc.get_appealdata()
+                cube = ifrc.indicators
+                assert cube.dimensions == ("month", "countryiso", "atype")
+                assert sum(x["number"] for x in cube.to_rows()) == len(rows)
+                assert cube.get("2023-02", "GNQ", "DREFs") == {
+                    "number": 1,
+                    "funded": 299929.0,
+                    "beneficiaries": 300000.0,
+                }
+                assert cube.get("2023-02", "XXX", "DREFs")["number"] == 0
+                expected = {}
+                for row in rows:
+                    if row["start_date"][:7] not in ("2023-01", "2023-02", "2023-03"):
+                        continue
+                    key = (row["country.iso3"], row["atype"] == 0)
+                    expected[key] = expected.get(key, 0) + float(row["amount_funded"])
+                quarterly = cube.quarterly()
+                for (countryiso, dref), funded in expected.items():
+                    atype = "DREFs" if dref else "Appeals"
+                    result = quarterly.get("2023-Q1", countryiso, atype)
+                    assert result["funded"] == pytest.approx(funded)
+
+                Locations.set_validlocations([{"name": "world", "title": "world"}])
+                dataset = Dataset({"name": "test"})
+                assert ifrc.add_indicators_resource(folder, dataset) is True
+                assert (
+                    dataset.get_resource()["name"]
+                    == "Global IFRC Appeals Monthly Indicators"
+                )
+
+    def test_field_mapping(self):
+        derivations = {"lower": str.lower}
+        mapping = FieldMapping(
+            {
+                "country": "iso3",
+                "exclude": {"status": [3], "country.iso3": [None]},
+                "fields": {
+                    "iso3": "country.iso3",
+                    "lower": {"derive": "lower", "from": "iso3"},
+                    "districts": {"path": "districts", "join": ", ", "item": "name"},
+                    "sectors": {"path": "sectors", "join": "|"},
+                },
+            },
+            derivations,
+        )
+        records = [
+            {
+                "status": 1,
+                "country": {"iso3": "AFG"},
+                "districts": [{"name": "a"}, {"name": "b"}],
+                "sectors": ["x", "y"],
+            },
+            {"status": 3, "country": {"iso3": "BDI"}},
+            {"status": 1, "country": {"iso3": None}},
+        ]
+        rows = mapping.extract_batch(records)
+        assert rows == [
+            {"iso3": "AFG", "lower": "afg", "districts": "a, b", "sectors": "x|y"}
+        ]
+        assert list(rows[0]) == ["iso3", "lower", "districts", "sectors"]
+
+        mapping = FieldMapping(
+            {
+                "country": "country.iso3",
+                "flatten": True,
+                "rename": {"n": "m"},
+                "fields": {
+                    "country.name": {"derive": "lower", "from": "country.iso3"},
+                    "extra": "country.iso3",
+                },
+            },
+            derivations,
+        )
+        rows = mapping.extract_batch(
+            [{"n": 1, "country": {"iso3": "AFG", "name": "X"}, "z": 2}]
+        )
+        assert rows == [
+            {
+                "country.iso3": "AFG",
+                "country.name": "afg",
+                "z": 2,
+                "m": 1,
+                "extra": "AFG",
+            }
+        ]
+        assert list(rows[0]) == ["country.iso3", "country.name", "z", "m", "extra"]
+        # no derivation without a country
+        rows = mapping.extract_batch([{"n": 1, "country": {"iso3": None}}])
+        assert rows[0]["country.name"] is None
+        with pytest.raises(ValueError):
+            FieldMapping({"country": "iso3", "fields": {"a": {"b": 1}}}, {})